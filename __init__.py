@@ -8,6 +8,10 @@ particle_velocity = [5000, 0, 0]  # m/s
 #Simulation setup
 timestep = 0.1  # seconds
 total_steps = 100 # Total timesteps
+collision_mode = "monte_carlo" # "monte_carlo" (sampled particles) or "expected" (closed-form expected torque)
+sampling = "random" # Collision sampling: "random", "stratified" (jittered grid) or "sobol" (scrambled Sobol points)
+torque_tolerance = None # Target standard error of the sampled torque (N·m); None keeps the particle count set by particle_mass
+integrator = "euler" # "euler" (explicit Euler on the angles), "rk4" or "rk45" (quaternion attitude, full Euler equations)
 
 # Initialize angles
 angles = np.zeros(3) # theta_x, theta_y, theta_z
@@ -33,7 +37,7 @@ face_colors = {
 
 class Satellite:
 
-    def __init__(self, length, width, height, com, initial_angular_velocity, inertia_matrix, sim_id):
+    def __init__(self, length, width, height, com, initial_angular_velocity, inertia_matrix, sim_id=None):
         """
         Initialize the satellite object with its physical parameters.
         
@@ -43,6 +47,7 @@ class Satellite:
         :param com: Position vector of the Center of Mass (m), given as a NumPy array [x, y, z]
         :param initial_angular_velocity: Initial angular velocity vector (rad/s), NumPy array [ωx, ωy, ωz]
         :param inertia_matrix: 3x3 Moment of Inertia matrix (kg·m²), NumPy array
+        :param sim_id: Description of the simulation used in the output file names (asked for by solver.py when not given)
         """
         self.length = length
         self.width = width
@@ -60,7 +65,7 @@ class Satellite:
             "-Z": self.width*self.length,
             }
 
-        self.sim_id = input("Enter simulation id")
+        self.sim_id = sim_id
     
 
 """Parameters of the Delfi n3xt satellite 
@@ -0,0 +1,160 @@
+"""
+Quaternion attitude propagation with Runge-Kutta integrators.
+
+The attitude is a unit quaternion [x, y, z, w] (scalar last, as in scipy) rotating the body frame
+into the global frame, and the angular velocity is expressed in the body frame. The state
+y = [q, ω] is propagated with the full Euler rigid-body equations
+
+    dq/dt = 1/2 q ⊗ [ω, 0]
+    dω/dt = I^(-1) (τ - ω × Iω)
+
+either with classic RK4 or with the adaptive Dormand-Prince RK45 pair, which takes substeps within a
+timestep as needed to meet the tolerances.
+"""
+
+import numpy as np
+
+
+def quaternion_multiply(p, q):
+    """Hamilton product p ⊗ q of quaternions [x, y, z, w]."""
+    px, py, pz, pw = p
+    qx, qy, qz, qw = q
+    return np.array([
+        pw*qx + px*qw + py*qz - pz*qy,
+        pw*qy - px*qz + py*qw + pz*qx,
+        pw*qz + px*qy - py*qx + pz*qw,
+        pw*qw - px*qx - py*qy - pz*qz,
+    ])
+
+
+def quaternion_from_angles(angles):
+    """
+    Quaternion of the rotation described by helpers.compute_rotation_matrix(angles).
+    :param angles: Rotation angles [theta_x, theta_y, theta_z] in radians (ZYX rotation order).
+    :return: Unit quaternion [x, y, z, w].
+    """
+    half = np.asarray(angles, dtype=float) / 2
+    q_x = np.array([np.sin(half[0]), 0, 0, np.cos(half[0])])
+    q_y = np.array([0, np.sin(half[1]), 0, np.cos(half[1])])
+    q_z = np.array([0, 0, np.sin(half[2]), np.cos(half[2])])
+    return quaternion_multiply(q_z, quaternion_multiply(q_y, q_x))
+
+
+def rotation_matrix(q):
+    """
+    Rotation matrix of a unit quaternion [x, y, z, w], from the body frame to the global frame.
+    """
+    x, y, z, w = q
+    return np.array([
+        [1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)],
+        [2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)],
+        [2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)],
+    ])
+
+
+def angles_from_rotation_matrix(matrix):
+    """
+    Rotation angles [theta_x, theta_y, theta_z] (ZYX rotation order) of a rotation matrix, the
+    inverse of helpers.compute_rotation_matrix().
+    """
+    return np.array([
+        np.arctan2(matrix[2, 1], matrix[2, 2]),
+        -np.arcsin(np.clip(matrix[2, 0], -1, 1)),
+        np.arctan2(matrix[1, 0], matrix[0, 0]),
+    ])
+
+
+def quaternion_derivative(q, angular_velocity):
+    """Time derivative of the attitude quaternion for a body-frame angular velocity."""
+    return 0.5 * quaternion_multiply(q, np.append(angular_velocity, 0))
+
+
+def angular_acceleration(angular_velocity, torque, inertia_matrix, inverse_inertia):
+    """Euler's rigid-body equation: alpha = I^(-1) (τ - ω × Iω)."""
+    return inverse_inertia @ (torque - np.cross(angular_velocity, inertia_matrix @ angular_velocity))
+
+
+def rk4_step(derivative, y, h):
+    """
+    One step of the classic fourth-order Runge-Kutta method.
+    :param derivative: Function returning dy/dt for a state y.
+    :param y: State vector.
+    :param h: Step size (s).
+    :return: State after the step.
+    """
+    k1 = derivative(y)
+    k2 = derivative(y + h/2 * k1)
+    k3 = derivative(y + h/2 * k2)
+    k4 = derivative(y + h * k3)
+    return y + h/6 * (k1 + 2*k2 + 2*k3 + k4)
+
+
+# Dormand-Prince 5(4) coefficients
+_dp_a = [
+    [],
+    [1/5],
+    [3/40, 9/40],
+    [44/45, -56/15, 32/9],
+    [19372/6561, -25360/2187, 64448/6561, -212/729],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+    [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84],
+]
+_dp_b5 = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0])
+_dp_b4 = np.array([5179/57600, 0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40])
+
+
+def rk45_step(derivative, y, h):
+    """
+    One Dormand-Prince step.
+    :param derivative: Function returning dy/dt for a state y.
+    :param y: State vector.
+    :param h: Step size (s).
+    :return: Fifth-order state after the step and the estimate of its local error.
+    """
+    k = []
+    for a in _dp_a:
+        k.append(derivative(y + h * sum(a_j * k_j for a_j, k_j in zip(a, k))) if a else derivative(y))
+    k = np.array(k)
+    return y + h * (_dp_b5 @ k), h * ((_dp_b5 - _dp_b4) @ k)
+
+
+def propagate(derivative, y, timestep, method="rk4", step_size=None, rtol=1e-6, atol=1e-9, min_step=None):
+    """
+    Propagate a state [q, ω] over one timestep and renormalize the quaternion.
+
+    :param derivative: Function returning dy/dt for a state y = [q, ω].
+    :param y: State vector [qx, qy, qz, qw, ωx, ωy, ωz].
+    :param timestep: Duration of the timestep (s).
+    :param method: "rk4" (one step per timestep) or "rk45" (adaptive substeps).
+    :param step_size: Initial substep size of rk45 (s), e.g. the one returned by the previous call.
+    :param rtol: Relative tolerance of rk45.
+    :param atol: Absolute tolerance of rk45.
+    :param min_step: Substeps of rk45 are accepted without error control below this size
+                     (defaults to timestep / 1024).
+    :return: State after the timestep and the substep size to start the next timestep with.
+    """
+    if method == "rk4":
+        y = rk4_step(derivative, y, timestep)
+        y[:4] /= np.linalg.norm(y[:4])
+        return y, timestep
+
+    min_step = timestep / 1024 if min_step is None else min_step
+    h = timestep if step_size is None else min(step_size, timestep)
+    elapsed = 0.0
+    while timestep - elapsed > 1e-12 * timestep:
+        h_try = min(h, timestep - elapsed)
+        y_new, error = rk45_step(derivative, y, h_try)
+        scale = atol + rtol * np.maximum(np.abs(y), np.abs(y_new))
+        error_norm = np.sqrt(np.mean((error / scale)**2))
+
+        accepted = error_norm <= 1 or h_try <= min_step
+        if accepted:
+            y = y_new
+            y[:4] /= np.linalg.norm(y[:4])
+            elapsed += h_try
+        # Standard step size control with a safety factor, limited to a factor 5 change per step.
+        # A substep shortened to end on the timestep keeps the proposed size for the next timestep.
+        if not (accepted and h_try < h):
+            h = h_try * min(5, max(0.2, 0.9 * (error_norm + 1e-12)**-0.2))
+
+    return y, h
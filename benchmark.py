@@ -0,0 +1,267 @@
+"""
+Benchmarks of the solver hot path, compared against a stored baseline.
+
+Times the step loop of simulation.Simulation for a matrix of geometries (Delfi-n3Xt and 1U/3U/6U
+cubesats), particle counts (set through particle_mass) and step counts, and the kernels it is
+built from: helpers.generate_collision_point, helpers.compute_rotation_matrix, cold NRLMSIS-00
+evaluations and the vectorized density grid interpolation. Every case reports its throughput (steps/s, particles/s or calls/s) and peak memory, and
+runs with fixed seeds, so the timings and a checksum of the outputs are comparable between runs.
+
+The results are compared with a baseline file and the benchmark fails (exit code 1) if a case is
+slower than the baseline by more than the allowed factor or if its output checksum changed. The
+baseline of the reference build is committed as benchmark_baseline.json; a missing baseline fails
+the benchmark as well, unless --allow-missing-baseline is given.
+
+Example:
+
+    python benchmark.py --save-baseline             # Store the baseline on a reference build
+    python benchmark.py --max-slowdown 1.3          # Compare against it
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+
+def cubesat(units):
+    """Geometry of a 1U, 3U or 6U cubesat of 1.33 kg per unit with its centre of mass 1 cm off-centre."""
+    length, width, height = {1: (0.1, 0.1, 0.1), 3: (0.3, 0.1, 0.1), 6: (0.3, 0.2, 0.1)}[units]
+    mass = 1.33 * units
+    return {
+        "length": length,
+        "width": width,
+        "height": height,
+        "com": [length/2 - 0.01, width/2, height/2],
+        "inertia_matrix": np.diag([mass/12 * (width**2 + height**2),
+                                   mass/12 * (length**2 + height**2),
+                                   mass/12 * (length**2 + width**2)]),
+    }
+
+
+geometries = {
+    "Delfi-n3Xt": {},  # __init__.sat_object
+    "1U": cubesat(1),
+    "3U": cubesat(3),
+    "6U": cubesat(6),
+}
+particle_masses = [1e-11, 1e-12, 1e-13]  # Roughly 300, 3000 and 30000 particles per step
+step_counts = [100, 1000]
+
+
+def measure(function, repeat):
+    """
+    Time a function and measure its peak memory.
+
+    :param function: Function without arguments, returning the number of work items it processed
+                     and a checksum of its output
+    :param repeat: Number of timed repetitions, the fastest one is reported
+    :return: Dictionary with the fastest time (s), the work items, the checksum and the peak traced
+             memory (bytes) of an untimed repetition
+    """
+    # Memory is traced in a separate repetition, since tracemalloc slows the code down. It also
+    # warms up the caches and lazy imports before the timed repetitions.
+    tracemalloc.start()
+    function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items, checksum = function()
+        times.append(time.perf_counter() - start)
+
+    return {"time": min(times), "items": items, "checksum": checksum, "peak_memory": peak_memory}
+
+
+def step_loop_case(geometry, particle_mass, total_steps):
+    """Benchmark function of the simulation step loop."""
+    import simulation
+
+    def function():
+        config = dict(geometries[geometry], particle_mass=particle_mass, total_steps=total_steps, seed=0)
+        results = simulation.run(config)
+        return results["num_particles"].sum(), float(np.abs(results["angular_velocity"][-1]).sum())
+
+    return function
+
+
+def collision_point_case(calls):
+    """Benchmark function of helpers.generate_collision_point()."""
+    import helpers
+
+    def function():
+        random.seed(0)
+        checksum = 0.0
+        for i in range(calls):
+            checksum += helpers.generate_collision_point(("+X", "-X", "+Y", "-Y", "+Z", "-Z")[i % 6]).sum()
+        return calls, checksum
+
+    return function
+
+
+def rotation_matrix_case(calls):
+    """Benchmark function of helpers.compute_rotation_matrix()."""
+    import helpers
+
+    def function():
+        angles = np.random.default_rng(0).uniform(-np.pi, np.pi, (calls, 3))
+        checksum = 0.0
+        for row in angles:
+            checksum += helpers.compute_rotation_matrix(row)[0, 0]
+        return calls, checksum
+
+    return function
+
+
+def density_model_case(calls):
+    """Benchmark function of cold NRLMSIS-00 evaluations, with the memoization cleared before each call."""
+    import density
+
+    provider = density.DensityProvider()
+
+    def function():
+        checksum = 0.0
+        for _ in range(calls):
+            density._number_density.cache_clear()
+            checksum += provider.number_density()
+        return calls, checksum
+
+    return function
+
+
+def density_grid_case(points):
+    """Benchmark function of the vectorized density grid interpolation over altitude and local solar time."""
+    import density
+
+    provider = density.DensityProvider()
+    provider.build_grid(np.arange(300, 801, 10))
+    rng = np.random.default_rng(0)
+    altitudes, local_solar_times = rng.uniform(300, 800, points), rng.uniform(0, 24, points)
+
+    def function():
+        return points, float(np.log(provider.interpolate(altitudes, local_solar_times)).sum())
+
+    return function
+
+
+def cases(quick=False):
+    """Names and benchmark functions of all cases. quick keeps the smallest step count and particle count only."""
+    masses = particle_masses[:1] if quick else particle_masses
+    steps = step_counts[:1] if quick else step_counts
+    yield "generate_collision_point", collision_point_case(100000)
+    yield "compute_rotation_matrix", rotation_matrix_case(10000)
+    yield "density_model", density_model_case(10000)
+    yield "density_grid_interpolate", density_grid_case(10**6)
+    for geometry in geometries:
+        for particle_mass in masses:
+            for total_steps in steps:
+                yield f"step_loop/{geometry}/m={particle_mass:g}/steps={total_steps}", \
+                    step_loop_case(geometry, particle_mass, total_steps)
+
+
+def run_benchmarks(quick=False, repeat=5, select=None):
+    """
+    Run the benchmarks.
+
+    :param quick: Only run the smallest step loop cases
+    :param repeat: Number of timed repetitions per case
+    :param select: Optional substring, only the cases whose name contains it are run
+    :return: Dictionary of the results per case name
+    """
+    results = {}
+    for name, function in cases(quick):
+        if select is not None and select not in name:
+            continue
+        result = measure(function, repeat)
+        result["rate"] = result["items"] / result["time"]
+        if name.startswith("step_loop"):
+            result["steps_per_second"] = int(name.rsplit("=", 1)[1]) / result["time"]
+        results[name] = result
+    return results
+
+
+def compare(results, baseline, max_slowdown=1.25):
+    """
+    Compare benchmark results with a baseline.
+
+    :param results: Results of run_benchmarks()
+    :param baseline: Results of an earlier run_benchmarks()
+    :param max_slowdown: Largest allowed ratio of the time of a case to its baseline time
+    :return: List of the failure messages (empty if all cases pass)
+    """
+    failures = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        slowdown = result["time"] / baseline[name]["time"]
+        if slowdown > max_slowdown:
+            failures.append(f"{name}: {slowdown:.2f}x slower than the baseline (limit {max_slowdown:.2f}x)")
+        if not np.isclose(result["checksum"], baseline[name]["checksum"], rtol=1e-9, atol=0):
+            failures.append(f"{name}: output checksum {result['checksum']!r} differs from the baseline "
+                            f"{baseline[name]['checksum']!r}")
+    return failures
+
+
+def report(results, baseline=None):
+    """Print a table of the results, with the speed-up against the baseline if given."""
+    print(f"{'case':<48} {'time (s)':>10} {'steps/s':>10} {'items/s':>12} {'peak MB':>9} {'vs base':>8}")
+    for name, result in results.items():
+        steps_per_second = f"{result['steps_per_second']:.1f}" if "steps_per_second" in result else "-"
+        ratio = f"{baseline[name]['time'] / result['time']:.2f}x" if baseline and name in baseline else "-"
+        print(f"{name:<48} {result['time']:>10.4f} {steps_per_second:>10} {result['rate']:>12.4g} "
+              f"{result['peak_memory'] / 2**20:>9.2f} {ratio:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the solver hot path")
+    parser.add_argument("--baseline", default=baseline_path, help="Baseline file (JSON)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--allow-missing-baseline", action="store_true",
+                        help="Only report the results if there is no baseline file, instead of failing")
+    parser.add_argument("--max-slowdown", type=float, default=1.25,
+                        help="Fail if a case takes longer than this factor times its baseline time")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repetitions per case")
+    parser.add_argument("--quick", action="store_true", help="Only run the smallest step loop cases")
+    parser.add_argument("--select", help="Only run the cases whose name contains this string")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.quick, args.repeat, args.select)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+    report(results, baseline)
+
+    document = {"python": sys.version.split()[0], "numpy": np.__version__, "results": results}
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(document, file, indent=2, default=float)
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(document, file, indent=2, default=float)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return 0 if args.allow_missing_baseline else 1
+    failures = compare(results, baseline, args.max_slowdown)
+    for failure in failures:
+        print("FAIL", failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
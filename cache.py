@@ -0,0 +1,329 @@
+"""
+Content-addressed cache of simulation runs.
+
+A run is keyed by a hash of its full normalized configuration, i.e. the state of the Simulation
+before its first step with every default filled in (satellite, timestep, particle masses, density
+inputs, random generator state, integrator, ...), and of the source code of the package. Functions
+in the configuration, e.g. a lambda of a density provider, are keyed by their name, bytecode,
+constants, defaults and closure values, so different functions never share a key. The
+description sim_id and the instrumentation (profiler, progress log) are not part of the key. A run
+that was computed before is returned from the cache without stepping. Runs without a seed draw a
+new random state and are therefore never found in the cache.
+
+The results of a run are stored together with the Simulation at its end, so a longer run of the
+same configuration continues the cached one from its final state instead of starting over (prefix
+reuse): a 10,000-step request extends a cached 5,000-step run by 5,000 steps, with the same results
+as an uncached run. A shorter request returns the first rows of a cached longer run. Runs whose
+course depends on their length (with an orbit timeline, a convergence monitor or multi-rate
+stepping) are keyed by their length as well and only reused as a whole.
+
+The cache is limited in size: after a run is stored, the least recently used runs are evicted
+until the cache fits. Entries are written atomically, and a lock file per configuration makes
+parallel workers wait for a run that another worker is computing instead of computing it again.
+
+Example:
+
+    run_cache = cache.RunCache("run_cache", max_bytes=2 * 1024**3)
+    results = run_cache.run({"com": [0.15, 0.05, 0.05], "total_steps": 10000, "seed": 1})
+    run_cache.status                                # "hit", "extended" or "miss"
+"""
+
+import contextlib
+import datetime
+import functools
+import glob
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+import checkpoint
+import profiling
+import simulation
+
+
+# Simulation attributes that do not change the results of a run
+ignored_attributes = ("total_steps", "verbose", "progress", "profiler", "history_rows")
+
+_code_version = None
+
+
+def code_version():
+    """Hash of the source files of the package, so that a change of the code invalidates the cache."""
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha1()
+        for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+            with open(path, "rb") as file:
+                digest.update(os.path.basename(path).encode() + file.read())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def normalize_code(code):
+    """Plain JSON data of a code object: its bytecode, constants (with nested code) and names."""
+    return {"bytecode": hashlib.sha1(code.co_code).hexdigest(), "names": list(code.co_names),
+            "constants": [normalize_code(constant) if hasattr(constant, "co_code") else normalize(constant)
+                          for constant in code.co_consts]}
+
+
+def normalize_callable(value):
+    """
+    Plain JSON data of a function, bound method or functools.partial, so that two functions only
+    normalize to the same data if they compute the same. Plain data globals read by a function are
+    included; other globals (modules, functions) are taken by name.
+
+    :return: Normalized data, or None if value is not one of these callables
+    """
+    if isinstance(value, functools.partial):
+        return {"partial": normalize(value.func), "args": normalize(value.args),
+                "keywords": normalize(value.keywords)}
+    if hasattr(value, "__func__") and hasattr(value, "__self__"):
+        return {"method": normalize(value.__func__), "self": normalize(value.__self__)}
+    if not hasattr(value, "__code__"):
+        return None
+    code = value.__code__
+    global_values = {name: value.__globals__[name] for name in code.co_names if name in value.__globals__}
+    return {
+        "function": f"{value.__module__}.{value.__qualname__}",
+        "code": normalize_code(code),
+        "defaults": normalize(value.__defaults__),
+        "keyword_defaults": normalize(value.__kwdefaults__),
+        "closure": [normalize(cell.cell_contents) for cell in value.__closure__ or ()],
+        "globals": {name: normalize(item) for name, item in global_values.items()
+                    if item is None or isinstance(item, (bool, int, float, str, np.generic, np.ndarray))},
+    }
+
+
+def normalize(value):
+    """
+    Convert a configuration value to plain JSON data, recursing into the attributes of objects.
+    Arrays are replaced by the hash of their contents, functions by their code (see
+    normalize_callable()).
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return {"array": hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest(),
+                "dtype": str(value.dtype), "shape": list(value.shape)}
+    if isinstance(value, dict):
+        return {str(key): normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, np.random.Generator):
+        return normalize(value.bit_generator.state)
+    if isinstance(value, type):
+        return {"type": f"{value.__module__}.{value.__qualname__}"}
+    if callable(value):
+        function = normalize_callable(value)
+        if function is not None:
+            return function
+        if not hasattr(value, "__dict__"):
+            # Built-in functions and ufuncs, whose repr names them
+            name = getattr(value, "__qualname__", getattr(value, "__name__", None))
+            if name is None:
+                raise ValueError(f"Cannot key the run cache on the callable {value!r}")
+            return {"builtin": f"{getattr(value, '__module__', None)}.{name}"}
+    if hasattr(value, "__dict__"):
+        # Pickled state where a class defines one, e.g. without the worker pool of parallel.ParallelTorque
+        state = value.__getstate__() if "__getstate__" in vars(type(value)) else vars(value)
+        return {"class": type(value).__qualname__, "state": normalize(state)}
+    return repr(value)
+
+
+def run_key(sim):
+    """
+    Cache key of a Simulation that has not started yet.
+
+    :return: Hash of the configuration and the code version, and whether the run can be extended or
+             truncated (False if its course depends on its length, which is then part of the key)
+    """
+    state = {name: value for name, value in vars(sim).items() if name not in ignored_attributes}
+    state["sat"] = {name: value for name, value in vars(sim.sat).items() if name != "sim_id"}
+    reusable = sim.timeline is None and sim.monitor is None
+    if not reusable:
+        state["total_steps"] = sim.total_steps
+    text = json.dumps({"code": code_version(), "simulation": normalize(state)}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest(), reusable
+
+
+@contextlib.contextmanager
+def file_lock(path, blocking=True):
+    """
+    Hold an exclusive lock on a lock file, waiting for other processes that hold it.
+
+    :param blocking: Wait for the lock; otherwise yield False at once if another process holds it
+    :return: Context manager yielding whether the lock is held
+    """
+    while True:
+        with open(path, "a+b") as file:
+            if os.name == "nt":
+                import msvcrt
+
+                while True:
+                    try:
+                        file.seek(0)
+                        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            yield False
+                            return
+                        # LK_LOCK gives up after 10 s, keep waiting
+                try:
+                    yield True
+                finally:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+                return
+
+            import fcntl
+
+            try:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                # Evict() removes the lock files of evicted runs while holding them: lock the new file instead
+                try:
+                    current = os.path.samestat(os.fstat(file.fileno()), os.stat(path))
+                except FileNotFoundError:
+                    current = False
+                if current:
+                    yield True
+                    return
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+class RunCache:
+
+    def __init__(self, directory, max_bytes=2**30):
+        """
+        :param directory: Directory of the cache (created if needed)
+        :param max_bytes: Size the cache is evicted down to after a run is stored
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.status = None  # "hit", "extended" or "miss" for the last run
+        os.makedirs(directory, exist_ok=True)
+
+    def run(self, config=None):
+        """Cached simulation.run() of a configuration dictionary (without output writer or checkpoints)."""
+        return self.run_simulation(simulation.build(config))
+
+    def run_simulation(self, sim, total_steps=None):
+        """
+        Cached Simulation.run() of a simulation that has not started yet.
+
+        :param sim: Simulation object
+        :param total_steps: Number of timesteps (defaults to sim.total_steps)
+        :return: Results of Simulation.run()
+        """
+        sim.total_steps = sim.total_steps if total_steps is None else total_steps
+        key, reusable = run_key(sim)
+        path = os.path.join(self.directory, f"{key}.pkl")
+
+        with file_lock(os.path.join(self.directory, f"{key}.lock")):
+            entry = None
+            try:
+                entry = checkpoint.load(path)
+                os.utime(path)  # Most recently used
+            except FileNotFoundError:
+                pass
+
+            if entry is not None and entry["steps"] >= sim.total_steps:
+                self.status = "hit"
+                if reusable:
+                    return checkpoint.filled_rows(entry["results"], sim.total_steps)
+                return entry["results"]
+
+            if entry is not None and reusable and entry["simulation"] is not None:
+                # Continue the cached run from its final state
+                self.status = "extended"
+                cached = entry["simulation"]
+                cached.sat.sim_id = sim.sat.sim_id
+                cached.verbose, cached.progress, cached.profiler = sim.verbose, sim.progress, sim.profiler
+                cached.total_steps = sim.total_steps
+                results = cached.run_until(sim.total_steps,
+                                           results=checkpoint.extend_rows(entry["results"], sim.total_steps))
+                sim = cached
+            else:
+                self.status = "miss"
+                results = sim.run()
+
+            profiler, progress = sim.profiler, sim.progress
+            sim.profiler, sim.progress = profiling.null_profiler, None  # Not stored with the run
+            try:
+                checkpoint.save(path, {"steps": sim.total_steps, "results": results, "simulation": sim})
+            except (pickle.PicklingError, AttributeError, TypeError):
+                # E.g. a lambda in the configuration: store the results only, which are not extended
+                checkpoint.save(path, {"steps": sim.total_steps, "results": results, "simulation": None})
+            finally:
+                sim.profiler, sim.progress = profiler, progress
+
+        self.evict()
+        return results
+
+    def entries(self):
+        """Paths of the cached runs, least recently used first."""
+        paths = []
+        for path in glob.glob(os.path.join(self.directory, "*.pkl")):
+            try:
+                paths.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                pass  # Evicted by another worker
+        return [path for _, path in sorted(paths)]
+
+    def evict(self):
+        """
+        Remove the least recently used runs, with their lock files, until the cache is at most
+        max_bytes large. Runs that another worker is using are kept.
+        """
+        with file_lock(os.path.join(self.directory, "evict.lock")):
+            paths = self.entries()
+            sizes = {}
+            for path in paths:
+                try:
+                    sizes[path] = os.path.getsize(path)
+                except FileNotFoundError:
+                    pass
+            total = sum(sizes.values())
+            for path in paths[:-1]:  # Always keep the most recent run
+                if total <= self.max_bytes:
+                    break
+                if self.remove(path):
+                    total -= sizes.get(path, 0)
+
+    def remove(self, path):
+        """
+        Remove a cached run and its lock file, unless another worker holds the lock.
+
+        :return: Whether the run was removed
+        """
+        lock_path = os.path.splitext(path)[0] + ".lock"
+        with file_lock(lock_path, blocking=False) as locked:
+            if not locked:
+                return False  # Being read or extended by another worker
+            try:
+                os.remove(path)
+            except OSError:
+                return False  # Already removed, or open in another process on Windows
+            if os.name != "nt":
+                os.remove(lock_path)  # Workers waiting for it lock a new file, see file_lock()
+        if os.name == "nt":
+            with contextlib.suppress(OSError):
+                os.remove(lock_path)  # Fails if another worker opened it meanwhile
+        return True
+
+    def clear(self):
+        """Remove all cached runs."""
+        with file_lock(os.path.join(self.directory, "evict.lock")):
+            for path in self.entries():
+                self.remove(path)
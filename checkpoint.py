@@ -0,0 +1,77 @@
+"""
+Checkpoints of simulation runs.
+
+A checkpoint holds the Simulation object (satellite state, attitude, step index, adaptive step size
+and the state of its random generator), the output.RunWriter of the run with the number of rows
+written to each file (or the rows of the in-memory histories filled so far), and the end step of
+the run. It is written to a temporary file, synced and
+renamed over the previous checkpoint, so a run killed at any point leaves a complete checkpoint.
+Resuming continues exactly as the uninterrupted run would have: rows written after the checkpoint
+are truncated and the same random numbers are drawn again.
+
+Example:
+
+    writer = output.RunWriter("runs", "Delfi_n3xt")
+    simulation.Simulation(total_steps=10**7).run(writer=writer, checkpoint_path="runs/Delfi_n3xt.ckpt")
+    # After the process was killed:
+    checkpoint.resume("runs/Delfi_n3xt.ckpt")
+"""
+
+import os
+import pickle
+
+import numpy as np
+
+
+def save(path, state):
+    """Atomically replace the checkpoint at path with a pickled state."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    """Load a checkpoint saved by save()."""
+    with open(path, "rb") as file:
+        return pickle.load(file)
+
+
+def filled_rows(results, rows):
+    """Histories of in-memory run results cut to their first rows, e.g. the rows filled so far."""
+    return {name: value[:rows] if isinstance(value, np.ndarray) else value for name, value in results.items()}
+
+
+def extend_rows(results, rows):
+    """Histories of in-memory run results enlarged to rows rows, the new rows left to be filled."""
+    extended = {}
+    for name, value in results.items():
+        if isinstance(value, np.ndarray):
+            extended[name] = np.empty((rows,) + value.shape[1:], dtype=value.dtype)
+            extended[name][:len(value)] = value
+        else:
+            extended[name] = value
+    return extended
+
+
+def resume(path, checkpoint_every=None, profiler=None, state=None):
+    """
+    Continue a run from its checkpoint until its end step, checkpointing to the same file.
+
+    :param path: Path of the checkpoint
+    :param checkpoint_every: Number of timesteps between checkpoints (defaults to that of the run)
+    :param profiler: Optional profiling.Profiler to instrument the resumed part of the run with
+    :param state: The checkpoint if it was already loaded with load()
+    :return: Results of Simulation.run() for the whole run
+    """
+    state = load(path) if state is None else state
+    checkpoint_every = state["checkpoint_every"] if checkpoint_every is None else checkpoint_every
+    if profiler is not None:
+        state["simulation"].profiler = profiler
+    results = state["results"]
+    if results is not None:
+        # Only the rows filled before the checkpoint are saved
+        results = extend_rows(results, state["rows"])
+    return state["simulation"].run_until(state["end_step"], state["writer"], results, path, checkpoint_every)
@@ -0,0 +1,161 @@
+"""
+Online steady-state detection and multi-rate stepping.
+
+A ConvergenceMonitor keeps a window of the last timesteps of a run and periodically computes the
+amplitude of the angular velocity oscillation, the amplitude of the attitude oscillation (the
+spread of the flow direction in the body frame), the trend of the rotational kinetic energy and
+the dominant oscillation period. The run has converged once the amplitudes stopped changing and
+the energy stopped drifting for `patience` consecutive checks; Simulation.run() can then stop
+early and reports the stop reason and the metrics with the results.
+
+With MultiRate, timesteps are merged into coarse steps of up to max_factor timesteps while the
+monitor finds the dynamics quiescent. A coarse step uses the torque averaged over its duration:
+the Euler integrator evaluates it at the attitudes at the midpoints of torque_samples equal parts
+of the step, predicted with the angular velocity at its start, and RK4 and RK45 at their stages.
+Each evaluation uses the number of particles of a fine step (each simulated particle carries the
+mass of factor particles). Coarse steps are limited to a fraction of the dominant period. The run drops back
+to fine steps when the angular velocity changes more than expected during a coarse step.
+
+Example:
+
+    monitor = convergence.ConvergenceMonitor(window=500)
+    results = simulation.Simulation(total_steps=10**6, monitor=monitor, multirate=convergence.MultiRate()).run()
+    results["stop_reason"], results["convergence"]
+"""
+
+import numpy as np
+
+
+class ConvergenceMonitor:
+
+    def __init__(self, window=500, check_every=None, amplitude_tolerance=0.02, energy_tolerance=0.01, patience=3,
+                 min_steps=0, stop=True):
+        """
+        :param window: Number of timesteps the metrics are computed over
+        :param check_every: Number of timesteps between checks (defaults to window / 5)
+        :param amplitude_tolerance: Largest relative change of the angular velocity and attitude
+                                    amplitudes between checks for a converged run
+        :param energy_tolerance: Largest relative change of the kinetic energy over the window
+                                 (from a linear fit) for a converged run
+        :param patience: Number of consecutive checks that have to meet the criterion
+        :param min_steps: Minimum number of timesteps before the run can converge
+        :param stop: Stop the run once it has converged
+        """
+        self.window = window
+        self.check_every = max(1, window // 5) if check_every is None else check_every
+        self.amplitude_tolerance = amplitude_tolerance
+        self.energy_tolerance = energy_tolerance
+        self.patience = patience
+        self.min_steps = min_steps
+        self.stop = stop
+
+        # Ring buffers of the window
+        self.time = np.zeros(window)
+        self.angular_velocity = np.zeros((window, 3))
+        self.flow_direction = np.zeros((window, 3))
+        self.energy = np.zeros(window)
+        self.samples = 0
+        self.since_check = 0
+
+        self.metrics = {}
+        self.hits = 0
+        self.quiescent = False
+        self.converged = False
+
+    def update(self, time, step, angular_velocity, rotation_matrix, inertia_matrix, flow_direction=(1, 0, 0)):
+        """
+        Add the state after a timestep and check for convergence every check_every timesteps.
+
+        :param time: Time at the end of the timestep (s)
+        :param step: Number of timesteps done so far
+        :param angular_velocity: Angular velocity (rad/s)
+        :param rotation_matrix: Rotation matrix from the body frame to the global frame
+        :param inertia_matrix: Inertia matrix (kg·m²)
+        :param flow_direction: Particle direction in the global frame
+        :return: True if the run has converged
+        """
+        i = self.samples % self.window
+        self.time[i] = time
+        self.angular_velocity[i] = angular_velocity
+        self.flow_direction[i] = rotation_matrix.T @ np.asarray(flow_direction, dtype=float)
+        self.energy[i] = 0.5 * angular_velocity @ inertia_matrix @ angular_velocity
+        self.samples += 1
+        self.since_check += 1
+
+        if self.samples >= self.window and self.since_check >= self.check_every:
+            self.since_check = 0
+            self.check(step)
+        return self.converged
+
+    def check(self, step):
+        """Compute the metrics of the window and update the convergence state."""
+        order = np.argsort(self.time)  # Oldest sample first
+        time, angular_velocity = self.time[order], self.angular_velocity[order]
+        flow_direction, energy = self.flow_direction[order], self.energy[order]
+
+        mean_direction = flow_direction.mean(axis=0)
+        mean_direction /= np.linalg.norm(mean_direction)
+        mean_energy = energy.mean()
+        slope = np.polyfit(time - time[0], energy, 1)[0] if time[-1] > time[0] else 0.0
+
+        metrics = {
+            "time": float(time[-1]),
+            "omega_amplitude": float(np.ptp(angular_velocity, axis=0).max() / 2),
+            "attitude_amplitude": float(np.arccos(np.clip(flow_direction @ mean_direction, -1, 1)).max()),
+            "mean_angular_speed": float(np.linalg.norm(angular_velocity, axis=1).mean()),
+            "energy": float(mean_energy),
+            "energy_trend": float(slope * (time[-1] - time[0]) / mean_energy) if mean_energy > 0 else 0.0,
+            "dominant_period": self.dominant_period(time, angular_velocity),
+        }
+
+        previous = self.metrics
+        self.quiescent = bool(previous) and abs(metrics["energy_trend"]) <= self.energy_tolerance and all(
+            abs(metrics[name] - previous[name]) <= self.amplitude_tolerance * max(previous[name], 1e-12)
+            for name in ("omega_amplitude", "attitude_amplitude"))
+        self.hits = self.hits + 1 if self.quiescent else 0
+        self.converged = self.hits >= self.patience and step >= self.min_steps
+        self.metrics = metrics
+
+    @staticmethod
+    def dominant_period(time, angular_velocity):
+        """
+        Dominant oscillation period (s) of the angular velocity component with the largest spread,
+        from its mean-crossings (valid for unequally spaced samples), or None without oscillation.
+        """
+        component = angular_velocity[:, np.argmax(angular_velocity.std(axis=0))]
+        signs = np.signbit(component - component.mean())
+        crossings = time[1:][signs[1:] != signs[:-1]]
+        if len(crossings) < 3:
+            return None
+        return float(2 * np.diff(crossings).mean())
+
+
+class MultiRate:
+
+    def __init__(self, max_factor=16, samples_per_period=20, change_tolerance=0.5, torque_samples=4):
+        """
+        :param max_factor: Largest number of timesteps merged into one coarse step
+        :param samples_per_period: Minimum number of steps per dominant period
+        :param change_tolerance: Drop back to fine steps when the angular velocity changes during a
+                                 coarse step by more than this fraction of the oscillation amplitude
+        :param torque_samples: Number of attitudes the torque of a coarse Euler step is averaged over
+        """
+        self.max_factor = max_factor
+        self.samples_per_period = samples_per_period
+        self.change_tolerance = change_tolerance
+        self.torque_samples = torque_samples
+
+    def factor(self, monitor, timestep):
+        """Number of timesteps of the next step: more than 1 while the monitor finds the dynamics quiescent."""
+        period = monitor.metrics.get("dominant_period")
+        if not monitor.quiescent or period is None:
+            return 1
+        return int(np.clip(period / (self.samples_per_period * timestep), 1, self.max_factor))
+
+    def observe(self, monitor, factor, angular_velocity_change):
+        """Drop back to fine steps if a coarse step changed the angular velocity more than expected."""
+        amplitude = monitor.metrics.get("omega_amplitude", 0.0)
+        if factor > 1 and np.abs(angular_velocity_change).max() > self.change_tolerance * max(amplitude, 1e-12):
+            monitor.quiescent = False
+            monitor.hits = 0
+            monitor.converged = False
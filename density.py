@@ -0,0 +1,148 @@
+"""
+Cached NRLMSIS-00 density lookup.
+
+The density model is only evaluated on first use. Point evaluations are memoized with an LRU cache
+keyed by the full model input, and an interpolation grid over altitude and local solar time can be
+prebuilt for fast vectorized lookups. The grid can be saved to disk, so that repeated runs and
+sweep workers load it instead of evaluating the model again.
+
+Example:
+
+    provider = DensityProvider()
+    provider.number_density()                       # Evaluated once, then cached
+    provider.build_grid(np.arange(300, 801, 5), path="density_grid.npz")
+    provider.interpolate([550, 600], [16, 4])       # Vectorized grid lookup
+"""
+
+import functools
+import os
+from datetime import datetime
+
+import numpy as np
+
+
+@functools.lru_cache(maxsize=4096)
+def _number_density(epoch, altitude, latitude, longitude, f107a, f107, ap, local_solar_time):
+    """
+    Evaluate NRLMSIS-00 and sum the densities it returns (cm^-3), as done originally with
+    sum(density_array[0]). Memoized on the full model input.
+    """
+    from nrlmsise00 import msise_model  # Imported on first use only
+
+    density_array = msise_model(epoch, altitude, latitude, longitude, f107a, f107, ap, lst=local_solar_time)
+    return sum(density_array[0])
+
+
+class DensityProvider:
+
+    def __init__(self, epoch=datetime(2013, 12, 1, 8, 3, 20), altitude=600, latitude=75, longitude=-70,
+                 f107a=150, f107=150, ap=4, local_solar_time=16):
+        """
+        Initialize the density provider with the default model input (the Delfi n3xt case).
+
+        :param epoch: Date and time (UTC)
+        :param altitude: Altitude (km)
+        :param latitude: Geodetic latitude (degrees)
+        :param longitude: Longitude (degrees)
+        :param f107a: 81-day average of the F10.7 solar flux (sfu)
+        :param f107: Daily F10.7 solar flux of the previous day (sfu)
+        :param ap: Daily geomagnetic Ap index
+        :param local_solar_time: Local solar time (hours)
+        """
+        self.inputs = dict(epoch=epoch, altitude=altitude, latitude=latitude, longitude=longitude,
+                           f107a=f107a, f107=f107, ap=ap, local_solar_time=local_solar_time)
+        self.altitudes = None
+        self.local_solar_times = None
+        self.log_density = None
+
+    def number_density(self, **inputs):
+        """
+        Total particle number density (cm^-3), evaluated lazily and memoized.
+
+        :param inputs: Model inputs overriding the defaults of the provider (see __init__)
+        :return: Sum of the densities returned by NRLMSIS-00
+        """
+        return _number_density(**dict(self.inputs, **inputs))
+
+    def grid_key(self):
+        """Model inputs that the interpolation grid depends on, used to validate saved grids."""
+        key = dict(self.inputs, epoch=self.inputs["epoch"].isoformat())
+        del key["altitude"], key["local_solar_time"]
+        return key
+
+    def build_grid(self, altitudes, local_solar_times=np.arange(0, 24.5, 0.5), path=None):
+        """
+        Tabulate the number density over altitude and local solar time for the other model inputs
+        of the provider. If path points to a saved grid with the same inputs, it is loaded instead.
+
+        :param altitudes: Increasing grid altitudes (km)
+        :param local_solar_times: Increasing grid local solar times covering 0 to 24 hours
+        :param path: Optional .npz file to load the grid from or save it to
+        """
+        altitudes = np.asarray(altitudes, dtype=float)
+        local_solar_times = np.asarray(local_solar_times, dtype=float)
+        if path is not None and os.path.exists(path) and self.load_grid(path) \
+                and np.array_equal(self.altitudes, altitudes) and np.array_equal(self.local_solar_times, local_solar_times):
+            return
+
+        # The density decays exponentially with altitude, so its logarithm is interpolated
+        self.altitudes = altitudes
+        self.local_solar_times = local_solar_times
+        self.log_density = np.log([[self.number_density(altitude=altitude, local_solar_time=local_solar_time)
+                                    for local_solar_time in local_solar_times]
+                                   for altitude in altitudes])
+        if path is not None:
+            self.save_grid(path)
+
+    def save_grid(self, path):
+        """
+        Save the interpolation grid to an .npz file. The file is written to a temporary file first
+        and renamed, so that concurrent sweep workers never read a partially written grid.
+        """
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file:
+            np.savez(file, altitudes=self.altitudes, local_solar_times=self.local_solar_times,
+                     log_density=self.log_density, **self.grid_key())
+        os.replace(temporary_path, path)
+
+    def load_grid(self, path):
+        """
+        Load an interpolation grid saved by save_grid().
+
+        :return: True if the grid was loaded, False if it was built for other model inputs
+        """
+        with np.load(path) as data:
+            if {name: data[name].item() for name in self.grid_key()} != self.grid_key():
+                return False
+            self.altitudes = data["altitudes"]
+            self.local_solar_times = data["local_solar_times"]
+            self.log_density = data["log_density"]
+        return True
+
+    def interpolate(self, altitude, local_solar_time=None):
+        """
+        Bilinear interpolation of the tabulated number density.
+
+        :param altitude: Altitude(s) (km), scalar or array
+        :param local_solar_time: Local solar time(s) (hours), scalar or array broadcastable with
+                                 altitude (defaults to the local solar time of the provider)
+        :return: Number density (cm^-3), with the broadcast shape of the inputs
+        """
+        if self.log_density is None:
+            raise RuntimeError("No density grid, call build_grid() first")
+        local_solar_time = self.inputs["local_solar_time"] if local_solar_time is None else local_solar_time
+        altitude, local_solar_time = np.broadcast_arrays(np.asarray(altitude, dtype=float),
+                                                         np.asarray(local_solar_time, dtype=float) % 24)
+
+        i, u = self._cell(self.altitudes, altitude)
+        j, v = self._cell(self.local_solar_times, local_solar_time)
+        log_density = ((1 - u) * (1 - v) * self.log_density[i, j] + u * (1 - v) * self.log_density[i + 1, j]
+                       + (1 - u) * v * self.log_density[i, j + 1] + u * v * self.log_density[i + 1, j + 1])
+        return np.exp(log_density)
+
+    @staticmethod
+    def _cell(grid, values):
+        """Index of the grid cell containing each value and the fractional position inside it."""
+        index = np.clip(np.searchsorted(grid, values, side="right") - 1, 0, len(grid) - 2)
+        fraction = (values - grid[index]) / (grid[index + 1] - grid[index])
+        return index, np.clip(fraction, 0, 1)
@@ -0,0 +1,190 @@
+"""
+Batched ensemble integrator.
+
+Steps N satellites (or N perturbed initial conditions of one satellite) at once. The angular
+velocity, attitude, geometry and inertia of the whole ensemble are stored as contiguous arrays, so
+the visible-face selection, the torque accumulation and the Euler update of simulation.Simulation
+run vectorized across the ensemble and the Python overhead is paid once per step.
+
+Example, 500 runs with perturbed initial angular velocities:
+
+    runs = ensemble.Ensemble.perturbed(__init__.sat_object, 500, angular_velocity_std=0.02, seed=1)
+    results = runs.run(1000)
+"""
+
+import numpy as np
+import helpers
+import __init__
+
+
+class Ensemble:
+
+    def __init__(self, satellites, angles=None, collision_mode=None, rng=None, timestep=None, total_steps=None,
+                 particle_velocity=None, particle_mass=None, actual_particle_mass=None, density_provider=None,
+                 seed=None):
+        """
+        Initialize the ensemble state arrays from a list of satellite objects. Parameters that are
+        not given default to the values in __init__.py, as for simulation.Simulation.
+
+        :param satellites: List of N Satellite objects
+        :param angles: (N, 3) array of initial rotation angles in rad (defaults to zeros)
+        :param collision_mode: "monte_carlo" or "expected"
+        :param rng: numpy.random.Generator used to sample the collisions (defaults to a generator of its own from seed)
+        :param timestep: Duration of one timestep of run() (s)
+        :param total_steps: Number of timesteps of run()
+        :param particle_velocity: Velocity vector of the particles (m/s)
+        :param particle_mass: Simulated mass of one particle (kg)
+        :param actual_particle_mass: Actual mass of one particle (kg)
+        :param density_provider: density.DensityProvider giving the particle number density
+        :param seed: Seed of the collision sampling if no rng is given
+        """
+        self.faces = list(__init__.face_normals.keys())
+        self.face_normals = np.array([__init__.face_normals[face] for face in self.faces], dtype=float)
+        self.face_axes = np.array([helpers.face_axes[face[1]] for face in self.faces])
+        self.face_signs = np.array([face[0] == "+" for face in self.faces], dtype=float)
+
+        self.dimensions = np.array([[sat.length, sat.width, sat.height] for sat in satellites], dtype=float)
+        self.com = np.array([sat.com for sat in satellites], dtype=float)
+        self.angular_velocity = np.array([sat.angular_velocity for sat in satellites], dtype=float)
+        self.inertia_matrix = np.array([sat.inertia_matrix for sat in satellites], dtype=float)
+        self.inverse_inertia = np.linalg.inv(self.inertia_matrix)  # Inverted once for the whole run
+        self.surface_area = np.array([[sat.surface_area[face] for face in self.faces] for sat in satellites])
+        self.angles = np.zeros((len(satellites), 3)) if angles is None else np.array(angles, dtype=float)
+
+        self.collision_mode = __init__.collision_mode if collision_mode is None else collision_mode
+        self.rng = np.random.default_rng(seed) if rng is None else rng
+        self.timestep = __init__.timestep if timestep is None else timestep
+        self.total_steps = __init__.total_steps if total_steps is None else total_steps
+        self.particle_velocity = np.array(__init__.particle_velocity if particle_velocity is None else particle_velocity, dtype=float)
+        self.particle_mass = __init__.particle_mass if particle_mass is None else particle_mass
+        self.actual_particle_mass = __init__.actual_particle_mass if actual_particle_mass is None else actual_particle_mass
+        self.density_provider = helpers.density_provider if density_provider is None else density_provider
+
+        # First and second moments of the lever arm over each face, constant for a rigid body
+        moments = [[helpers.face_moments(face, sat) for face in self.faces] for sat in satellites]
+        self.mean_lever_arm = np.array([[mean_r for mean_r, _ in sat_moments] for sat_moments in moments])
+        second_moment = np.array([[moment for _, moment in sat_moments] for sat_moments in moments])
+        self.moment_matrix = second_moment - np.trace(second_moment, axis1=2, axis2=3)[..., None, None] * np.eye(3)
+
+    @classmethod
+    def perturbed(cls, sat, num_satellites, angular_velocity_std=0.0, angles_std=0.0, seed=None, **kwargs):
+        """
+        Build an ensemble of copies of one satellite with normally distributed perturbations of the
+        initial angular velocity and attitude.
+
+        :param sat: Nominal Satellite object
+        :param num_satellites: Number of ensemble members
+        :param angular_velocity_std: Standard deviation of the angular velocity perturbation (rad/s)
+        :param angles_std: Standard deviation of the initial angle perturbation (rad)
+        :param seed: Seed of the perturbations and, unless an rng is given, of the collision sampling
+        :param kwargs: Passed on to Ensemble()
+        """
+        rng = np.random.default_rng(seed)
+        kwargs.setdefault("rng", rng)  # The collisions continue the stream of the perturbations
+        satellites = [__init__.Satellite(sat.length, sat.width, sat.height, sat.com,
+                                         sat.angular_velocity + rng.normal(0, angular_velocity_std, 3),
+                                         sat.inertia_matrix, sat.sim_id)
+                      for _ in range(num_satellites)]
+        return cls(satellites, angles=rng.normal(0, angles_std, (num_satellites, 3)), **kwargs)
+
+    def __len__(self):
+        return len(self.angular_velocity)
+
+    def compute_torque(self, probabilities, num_particles, expected_num_particles, timestep):
+        """
+        Compute the drag torque on every ensemble member.
+
+        :param probabilities: (N, 6) array of collision probabilities per face
+        :param num_particles: (N,) array of simulated particle counts
+        :param expected_num_particles: (N,) array of particle counts before rounding up
+        :param timestep: Duration of the timestep (s)
+        :return: (N, 3) array of torques (N·m) and (N, 6) array of collisions per face
+        """
+        particle_velocity = self.particle_velocity
+
+        if self.collision_mode == "expected":
+            # Closed-form expected torque, see helpers.compute_expected_torque()
+            collisions_per_face = expected_num_particles[:, None] * probabilities
+            face_torque = np.einsum("nfij,nj->nfi", self.moment_matrix, self.angular_velocity) \
+                - np.cross(self.mean_lever_arm, particle_velocity)
+            total_torque = np.einsum("nf,nfi->ni", collisions_per_face, face_torque) * self.particle_mass / timestep
+            return total_torque, collisions_per_face
+
+        # One multinomial draw per satellite distributes its particles over the faces
+        collisions_per_face = self.rng.multinomial(num_particles, probabilities)
+        member = np.repeat(np.repeat(np.arange(len(self)), len(self.faces)), collisions_per_face.ravel())
+        face = np.repeat(np.tile(np.arange(len(self.faces)), len(self)), collisions_per_face.ravel())
+
+        # Uniform collision points on the drawn faces of the satellites
+        dimensions = self.dimensions[member]
+        collision_points = self.rng.uniform(0, 1, (len(member), 3)) * dimensions
+        axis = self.face_axes[face]
+        collision_points[np.arange(len(member)), axis] = dimensions[np.arange(len(member)), axis] * self.face_signs[face]
+
+        r = collision_points - self.com[member]  # Lever arms (in meters)
+        satellite_velocity = np.cross(r, self.angular_velocity[member])
+        relative_velocity = satellite_velocity - particle_velocity
+        force = (self.particle_mass * relative_velocity)/timestep
+        torque = np.cross(r, force)
+
+        # Sum the particle torques per satellite
+        total_torque = np.stack([np.bincount(member, weights=torque[:, i], minlength=len(self)) for i in range(3)], axis=1)
+        return total_torque, collisions_per_face
+
+    def step(self, timestep):
+        """
+        Advance all ensemble members by one timestep.
+
+        :param timestep: Duration of the timestep (s)
+        :return: (N, 3) angular accelerations and (N, 6) collisions per face of this timestep
+        """
+        # Face normals of all satellites in the global frame, dotted with the particle direction (+X)
+        rotation_matrices = helpers.compute_rotation_matrices(self.angles)
+        dot_products = rotation_matrices[:, 0, :] @ self.face_normals.T
+        eligible = dot_products > 0  # Consider only faces eligible for collision
+        sum_surface = (self.surface_area * eligible).sum(axis=1)
+
+        #Compute actual and simulated number of particles colliding with each satellite per timestep
+        actual_num_particles = self.density_provider.number_density() * 10**6 * self.particle_velocity[0] * timestep * sum_surface
+        expected_num_particles = actual_num_particles * self.actual_particle_mass / self.particle_mass
+        num_particles = np.ceil(expected_num_particles).astype(np.int64)
+
+        # Normalize dot products of the eligible faces to probabilities
+        dot_products = np.where(eligible, dot_products, 0)
+        probabilities = dot_products / dot_products.sum(axis=1, keepdims=True)
+
+        total_torque, collisions_per_face = self.compute_torque(probabilities, num_particles, expected_num_particles, timestep)
+
+        # Euler update of all members: alpha = I^(-1) * total_torque, omega += alpha * dt, theta += omega * dt
+        angular_acceleration = np.einsum("nij,nj->ni", self.inverse_inertia, total_torque)
+        self.angular_velocity += angular_acceleration * timestep
+        self.angles += self.angular_velocity * timestep
+
+        return angular_acceleration, collisions_per_face
+
+    def run(self, total_steps=None, timestep=None):
+        """
+        Run the ensemble simulation.
+
+        :param total_steps: Number of timesteps (defaults to that of the ensemble)
+        :param timestep: Duration of one timestep in s (defaults to that of the ensemble)
+        :return: Dictionary with the angular velocity, acceleration and angle histories as
+                 (total_steps, N, 3) arrays and the particle counts as a (total_steps, N, 6) array
+        """
+        total_steps = self.total_steps if total_steps is None else total_steps
+        timestep = self.timestep if timestep is None else timestep
+
+        results = {
+            "angular_velocity": np.empty((total_steps, len(self), 3)),
+            "angular_acceleration": np.empty((total_steps, len(self), 3)),
+            "angles": np.empty((total_steps, len(self), 3)),
+            "particle_counts": np.empty((total_steps, len(self), len(self.faces))),
+        }
+        for step in range(total_steps):
+            angular_acceleration, collisions_per_face = self.step(timestep)
+            results["angular_velocity"][step] = self.angular_velocity
+            results["angular_acceleration"][step] = angular_acceleration
+            results["angles"][step] = self.angles
+            results["particle_counts"][step] = collisions_per_face
+
+        return results
@@ -0,0 +1,274 @@
+"""
+General satellite geometry as a mesh of planar faces.
+
+A Mesh is a set of planar faces (polygons, triangulated on load) that belong to one or more
+bodies, e.g. the bus of the satellite and its deployable solar panels. Normals, areas and
+centroids of the faces, and the data needed to draw uniform points on their triangles, are
+computed once when the mesh is built.
+
+In every timestep the faces facing the flow are weighted by their projected area, A cos θ, and a
+Walker/Vose alias table is built over them, so drawing the face of a particle costs O(1) whatever
+the number of faces. The triangle within the face is drawn from a precomputed alias table over the
+triangle areas of that face. Particles whose path upstream is blocked by another body are removed
+(self-shadowing): the blocking face is lit itself and receives its own particles.
+
+Unlike the six-face box model of __init__.py, where the face probabilities are proportional to
+cos θ and the particle count to the total area of the eligible faces, a mesh uses the projected
+area for both, so that faces of different sizes are weighted correctly.
+
+Example:
+
+    mesh = geometry.Mesh.box(0.3, 0.1, 0.1) + geometry.Mesh.panel([0.3, 0, 0.1], [0, 0, 0.3], [0, 0.1, 0], "panel")
+    simulation.Simulation(mesh=mesh).run()
+"""
+
+import numpy as np
+
+
+def alias_table(weights):
+    """
+    Walker/Vose alias table of a discrete distribution, built in O(n).
+
+    :param weights: Non-negative weights of the outcomes (not necessarily normalized)
+    :return: Acceptance probability and alias outcome of every table entry
+    """
+    weights = np.asarray(weights, dtype=float)
+    n = len(weights)
+    scaled = weights * n / weights.sum()
+    probability = np.ones(n)
+    alias = np.arange(n)
+
+    small = [i for i in range(n) if scaled[i] < 1]
+    large = [i for i in range(n) if scaled[i] >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        probability[less] = scaled[less]
+        alias[less] = more
+        scaled[more] -= 1 - scaled[less]
+        (small if scaled[more] < 1 else large).append(more)
+    # Entries left over due to rounding keep probability 1
+    return probability, alias
+
+
+def alias_draw(probability, alias, n, rng):
+    """Draw n outcomes from an alias table, in O(1) per draw."""
+    entries = rng.integers(0, len(probability), n)
+    accepted = rng.uniform(0, 1, n) < probability[entries]
+    return np.where(accepted, entries, alias[entries])
+
+
+def _polygon_normal(points):
+    """Unit normal of a planar polygon (Newell's method), oriented by the counter-clockwise vertex order."""
+    normal = np.cross(points, np.roll(points, -1, axis=0)).sum(axis=0)
+    return normal / np.linalg.norm(normal)
+
+
+class Mesh:
+
+    def __init__(self, polygons, face_names=None, bodies=None):
+        """
+        Build a mesh from planar polygons.
+
+        :param polygons: List of (k, 3) vertex arrays (in meters, body frame), one per face, with the
+                         vertices in counter-clockwise order seen from outside (the side the normal
+                         points to)
+        :param face_names: Names of the faces (defaults to "0", "1", ...)
+        :param bodies: Name of the body each face belongs to; only faces of different bodies can
+                       shadow each other (defaults to a single body)
+        """
+        polygons = [np.asarray(polygon, dtype=float) for polygon in polygons]
+        self.face_names = [str(i) for i in range(len(polygons))] if face_names is None else list(face_names)
+        bodies = ["body"] * len(polygons) if bodies is None else list(bodies)
+        self.body_names = list(dict.fromkeys(bodies))
+        self.face_body = np.array([self.body_names.index(body) for body in bodies])
+
+        # Fan triangulation; the triangles of a face are stored contiguously
+        a, b, c, triangle_face = [], [], [], []
+        for face, polygon in enumerate(polygons):
+            for i in range(1, len(polygon) - 1):
+                a.append(polygon[0])
+                b.append(polygon[i])
+                c.append(polygon[i + 1])
+                triangle_face.append(face)
+        self.triangle_a = np.array(a)
+        self.triangle_edges = np.stack([np.array(b) - self.triangle_a, np.array(c) - self.triangle_a], axis=1)
+        self.triangle_face = np.array(triangle_face)
+        self.triangle_area = np.linalg.norm(np.cross(self.triangle_edges[:, 0], self.triangle_edges[:, 1]), axis=1) / 2
+
+        self.face_normal = np.array([_polygon_normal(polygon) for polygon in polygons])
+        self.face_area = np.bincount(self.triangle_face, self.triangle_area, minlength=len(polygons))
+        triangle_centroid = self.triangle_a + self.triangle_edges.sum(axis=1) / 3
+        self.face_centroid = (np.stack([np.bincount(self.triangle_face, self.triangle_area * triangle_centroid[:, i],
+                                                    minlength=len(polygons)) for i in range(3)], axis=1)
+                              / self.face_area[:, None])
+
+        # Alias tables over the triangle areas of each face, stored as local indices per face
+        self.face_start = np.searchsorted(self.triangle_face, np.arange(len(polygons)))
+        self.face_triangles = np.bincount(self.triangle_face, minlength=len(polygons))
+        self.triangle_probability = np.ones(len(self.triangle_face))
+        self.triangle_alias = np.zeros(len(self.triangle_face), dtype=int)
+        for face, (start, count) in enumerate(zip(self.face_start, self.face_triangles)):
+            probability, alias = alias_table(self.triangle_area[start:start + count])
+            self.triangle_probability[start:start + count] = probability
+            self.triangle_alias[start:start + count] = alias
+
+    def __len__(self):
+        return len(self.face_names)
+
+    def __add__(self, other):
+        """Mesh of the faces of both meshes, e.g. a bus and its solar panels."""
+        return Mesh(self.polygons() + other.polygons(), self.face_names + other.face_names,
+                    [self.body_names[i] for i in self.face_body] + [other.body_names[i] for i in other.face_body])
+
+    def polygons(self):
+        """Vertices of the faces (as triangulated, with the first vertex of each face repeated per triangle)."""
+        polygons = []
+        for start, count in zip(self.face_start, self.face_triangles):
+            a, edges = self.triangle_a[start], self.triangle_edges[start:start + count]
+            polygons.append(np.concatenate([[a], a + edges[:, 0], [a + edges[-1, 1]]]))
+        return polygons
+
+    @classmethod
+    def box(cls, length, width, height, origin=(0, 0, 0), body="bus"):
+        """
+        Rectangular box spanning origin to origin + (length, width, height), with the faces "+X" ... "-Z"
+        of __init__.face_normals (the geometry of __init__.Satellite for the default origin).
+        """
+        x0, y0, z0 = origin
+        x1, y1, z1 = x0 + length, y0 + width, z0 + height
+        polygons = {
+            "+X": [[x1, y0, z0], [x1, y1, z0], [x1, y1, z1], [x1, y0, z1]],
+            "-X": [[x0, y0, z0], [x0, y0, z1], [x0, y1, z1], [x0, y1, z0]],
+            "+Y": [[x0, y1, z0], [x0, y1, z1], [x1, y1, z1], [x1, y1, z0]],
+            "-Y": [[x0, y0, z0], [x1, y0, z0], [x1, y0, z1], [x0, y0, z1]],
+            "+Z": [[x0, y0, z1], [x1, y0, z1], [x1, y1, z1], [x0, y1, z1]],
+            "-Z": [[x0, y0, z0], [x0, y1, z0], [x1, y1, z0], [x1, y0, z0]],
+        }
+        names = list(polygons)
+        if body != "bus":
+            names = [f"{body}{name}" for name in names]
+        return cls(list(polygons.values()), names, [body] * 6)
+
+    @classmethod
+    def panel(cls, corner, edge_1, edge_2, body="panel"):
+        """
+        Flat two-sided panel (e.g. a deployable solar panel) spanned by two edges from a corner. The
+        side with normal edge_1 × edge_2 is named body + "+", the other one body + "-".
+        """
+        corner, edge_1, edge_2 = (np.asarray(vector, dtype=float) for vector in (corner, edge_1, edge_2))
+        front = [corner, corner + edge_1, corner + edge_1 + edge_2, corner + edge_2]
+        return cls([front, front[::-1]], [f"{body}+", f"{body}-"], [body, body])
+
+    @classmethod
+    def load_obj(cls, path, scale=1.0):
+        """
+        Load a mesh from a Wavefront .obj file. Every "f" element is a face; "o" and "g" elements
+        name the body of the faces that follow.
+
+        :param path: Path of the .obj file
+        :param scale: Factor converting the coordinates of the file to meters
+        """
+        vertices, polygons, names, bodies = [], [], [], []
+        body = "body"
+        with open(path) as file:
+            for line in file:
+                fields = line.split()
+                if not fields:
+                    continue
+                if fields[0] == "v":
+                    vertices.append([float(value) * scale for value in fields[1:4]])
+                elif fields[0] in ("o", "g") and len(fields) > 1:
+                    body = fields[1]
+                elif fields[0] == "f":
+                    # Vertex indices are 1-based, negative ones count from the end
+                    indices = [int(field.split("/")[0]) for field in fields[1:]]
+                    polygons.append([vertices[i - 1 if i > 0 else i] for i in indices])
+                    names.append(f"{body}/{sum(existing == body for existing in bodies)}")
+                    bodies.append(body)
+        if not polygons:
+            raise ValueError(f"No faces in {path}")
+        return cls(polygons, names, bodies)
+
+    def projected_areas(self, rotation_matrix, direction=(1, 0, 0)):
+        """
+        Projected area of every face on the plane perpendicular to the flow, zero for faces facing away.
+
+        :param rotation_matrix: Rotation matrix from the body frame to the global frame
+        :param direction: Particle direction in the global frame, with the convention of
+                          Simulation.compute_torque(): faces whose normal points along it are hit
+        :return: Projected areas A cos θ (m²) and the particle direction in the body frame
+        """
+        body_direction = rotation_matrix.T @ np.asarray(direction, dtype=float)
+        cosines = self.face_normal @ body_direction
+        return self.face_area * np.maximum(cosines, 0), body_direction
+
+    def sample_points(self, face_weights, n, rng):
+        """
+        Draw n particles over the faces in proportion to face_weights and uniformly within each face.
+
+        :param face_weights: Weight of every face, e.g. its projected area (zero for faces not hit)
+        :param n: Number of particles
+        :param rng: numpy.random.Generator to draw from
+        :return: Face index and point (body frame, in meters) of every particle
+        """
+        eligible = np.flatnonzero(face_weights > 0)
+        probability, alias = alias_table(face_weights[eligible])
+        faces = eligible[alias_draw(probability, alias, n, rng)]
+
+        # Triangle within the face from the alias table of the face
+        entries = (rng.uniform(0, 1, n) * self.face_triangles[faces]).astype(int)
+        triangles = self.face_start[faces] + entries
+        accepted = rng.uniform(0, 1, n) < self.triangle_probability[triangles]
+        triangles = np.where(accepted, triangles, self.face_start[faces] + self.triangle_alias[triangles])
+
+        # Uniform point in the triangle, reflecting points of the parallelogram beyond the diagonal
+        uv = rng.uniform(0, 1, (n, 2))
+        outside = uv.sum(axis=1) > 1
+        uv[outside] = 1 - uv[outside]
+        points = self.triangle_a[triangles] + np.einsum("ni,nij->nj", uv, self.triangle_edges[triangles])
+        return faces, points
+
+    def shadowed(self, points, faces, body_direction, face_weights, chunk_size=2**20):
+        """
+        Test which particles are blocked by another body before reaching their point.
+
+        A particle is shadowed if the ray from its collision point towards the side the particles
+        come from (along the particle direction, see projected_areas()) hits a face of another body
+        that is hit itself (Möller-Trumbore ray-triangle test).
+
+        :param points: (n, 3) array of collision points (body frame)
+        :param faces: Face index of every point
+        :param body_direction: Particle direction in the body frame
+        :param face_weights: Weight of every face, faces with zero weight do not block particles
+        :param chunk_size: Maximum number of point-triangle pairs tested at once
+        :return: Boolean array, True for shadowed particles
+        """
+        shadowed = np.zeros(len(points), dtype=bool)
+        if len(self.body_names) < 2:
+            return shadowed  # Faces of one (convex) body do not shadow each other
+
+        ray = np.asarray(body_direction, dtype=float)
+        occluders = np.flatnonzero(face_weights[self.triangle_face] > 0)
+        a = self.triangle_a[occluders]
+        edge_1, edge_2 = self.triangle_edges[occluders, 0], self.triangle_edges[occluders, 1]
+        p = np.cross(ray, edge_2)
+        determinant = np.einsum("ti,ti->t", edge_1, p)
+        valid = np.abs(determinant) > 1e-12
+        a, edge_1, edge_2, p = a[valid], edge_1[valid], edge_2[valid], p[valid]
+        inverse = 1 / determinant[valid]
+        occluder_body = self.face_body[self.triangle_face[occluders[valid]]]
+        if not len(a):
+            return shadowed
+
+        point_body = self.face_body[faces]
+        rows = max(1, chunk_size // len(a))
+        for start in range(0, len(points), rows):
+            origin = points[start:start + rows, None, :] - a[None]  # (rows, triangles, 3)
+            u = np.einsum("nti,ti->nt", origin, p) * inverse
+            q = np.cross(origin, edge_1[None])
+            v = (q @ ray) * inverse
+            t = np.einsum("nti,ti->nt", q, edge_2) * inverse
+            hit = (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 1e-9)
+            hit &= occluder_body[None] != point_body[start:start + rows, None]
+            shadowed[start:start + rows] = hit.any(axis=1)
+        return shadowed
@@ -1,13 +1,10 @@
-from nrlmsise00 import msise_model
-import msise00
-from datetime import datetime
 import random
-from scipy.spatial.transform import Rotation as R
 import numpy as np
 import __init__ 
+import density
 
-#Density model: NRLMSIS-00
-density_array = msise_model(datetime(2013, 12, 1, 8, 3, 20), 600, 75, -70, 150, 150, 4, lst=16)
+#Density model: NRLMSIS-00, evaluated on first use and cached (see density.py)
+density_provider = density.DensityProvider()
 #density_array = msise00.run(time=datetime(2013, 3, 31, 12), altkm=150., glat=65., glon=-148.)
 
 """
@@ -35,6 +32,81 @@ def generate_collision_point(face):
     elif face == "-Z":
         return np.array([ random.uniform(0, __init__.sat_object.length),  random.uniform(0, __init__.sat_object.width), 0])
 
+# Index of the axis each face is perpendicular to
+face_axes = {"X": 0, "Y": 1, "Z": 2}
+
+# Random number generator used by the vectorized collision kernel
+random_generator = np.random.default_rng()
+
+# Generate a batch of collision points on a given face
+def generate_collision_points(face, n, sat=None, rng=None):
+    """
+    Generate n uniformly distributed collision points on a given face in one call.
+    :param face: The face to generate collision points for ("+X" ... "-Z").
+    :param n: Number of collision points.
+    :param sat: Satellite object providing the dimensions (defaults to __init__.sat_object).
+    :param rng: numpy.random.Generator to draw from (defaults to helpers.random_generator).
+    :return: (n, 3) array of collision points on the satellite surface (in meters).
+    """
+    sat = __init__.sat_object if sat is None else sat
+    rng = random_generator if rng is None else rng
+    dims = np.array([sat.length, sat.width, sat.height])
+    axis = face_axes[face[1]]
+
+    points = rng.uniform(0, 1, (n, 3)) * dims
+    points[:, axis] = dims[axis] if face[0] == "+" else 0
+    return points
+
+# First and second moments of the collision points on a face
+def face_moments(face, sat):
+    """
+    Compute the mean lever arm and the second moment of the lever arm over a face, for points
+    distributed uniformly over the face rectangle.
+    :param face: The face ("+X" ... "-Z").
+    :param sat: Satellite object (dimensions and centre of mass).
+    :return: Mean lever arm E[r] (m) and second moment matrix E[r r^T] (m²).
+    """
+    dims = np.array([sat.length, sat.width, sat.height])
+    axis = face_axes[face[1]]
+
+    centroid = dims / 2
+    centroid[axis] = dims[axis] if face[0] == "+" else 0
+    variance = dims**2 / 12  # Variance of a uniform distribution over [0, a]
+    variance[axis] = 0
+
+    mean_r = centroid - sat.com
+    return mean_r, np.outer(mean_r, mean_r) + np.diag(variance)
+
+# Closed-form expected torque replacing the Monte Carlo sampling
+def compute_expected_torque(probabilities, num_particles, sat, particle_velocity, particle_mass, timestep,
+                            angular_velocity=None):
+    """
+    Compute the expected value of the sampled torque of sampling.collision_torque() by integrating
+    over the face rectangles. With r x (r x w) = r (r.w) - w |r|², the torque per face only depends
+    on the first and second moments of the lever arm, so the cost does not depend on the number of
+    particles and there is no sampling noise.
+    :param probabilities: Dictionary of collision probabilities of the eligible faces.
+    :param num_particles: Number of simulated particles colliding in this timestep (need not be an integer).
+    :param sat: Satellite object (dimensions, centre of mass and angular velocity).
+    :param particle_velocity: Velocity vector of the particles (m/s).
+    :param particle_mass: Simulated mass of one particle (kg).
+    :param timestep: Duration of the timestep (s).
+    :param angular_velocity: Angular velocity to evaluate the torque at (defaults to sat.angular_velocity).
+    :return: Expected total torque (N·m) and expected collisions per face.
+    """
+    angular_velocity = sat.angular_velocity if angular_velocity is None else angular_velocity
+    total_torque = np.zeros(3)
+    collisions_per_face = {}
+    for face, probability in probabilities.items():
+        mean_r, second_moment = face_moments(face, sat)
+        # E[r x (r x w - v)] = (E[r r^T] - tr(E[r r^T]) I) w - E[r] x v
+        face_torque = (second_moment - np.trace(second_moment) * np.eye(3)) @ angular_velocity \
+            - np.cross(mean_r, particle_velocity)
+        collisions_per_face[face] = num_particles * probability
+        total_torque += collisions_per_face[face] * particle_mass / timestep * face_torque
+
+    return total_torque, collisions_per_face
+
 #Function to compute rotation matrix from current angles
 def compute_rotation_matrix(angles):
     """
@@ -42,10 +114,32 @@ def compute_rotation_matrix(angles):
     :param angles: Array of rotation angles [theta_x, theta_y, theta_z] in radians.
     :return: Combined rotation matrix.
     """
+    from scipy.spatial.transform import Rotation as R  # Imported on first use only
+
     rot_x = R.from_euler('x', angles[0], degrees=False).as_matrix()
     rot_y = R.from_euler('y', angles[1], degrees=False).as_matrix()
     rot_z = R.from_euler('z', angles[2], degrees=False).as_matrix()
     
     return rot_z @ rot_y @ rot_x  # ZYX rotation order
 
+# Function to compute the rotation matrices of many sets of angles at once
+def compute_rotation_matrices(angles):
+    """
+    Vectorized version of compute_rotation_matrix() for an array of angles.
+    :param angles: (N, 3) array of rotation angles [theta_x, theta_y, theta_z] in radians.
+    :return: (N, 3, 3) array of combined rotation matrices (ZYX rotation order).
+    """
+    cx, cy, cz = np.cos(angles).T
+    sx, sy, sz = np.sin(angles).T
 
+    rotation_matrices = np.empty((len(angles), 3, 3))
+    rotation_matrices[:, 0, 0] = cz*cy
+    rotation_matrices[:, 0, 1] = cz*sy*sx - sz*cx
+    rotation_matrices[:, 0, 2] = cz*sy*cx + sz*sx
+    rotation_matrices[:, 1, 0] = sz*cy
+    rotation_matrices[:, 1, 1] = sz*sy*sx + cz*cx
+    rotation_matrices[:, 1, 2] = sz*sy*cx - cz*sx
+    rotation_matrices[:, 2, 0] = -sy
+    rotation_matrices[:, 2, 1] = cy*sx
+    rotation_matrices[:, 2, 2] = cy*cx
+    return rotation_matrices
@@ -0,0 +1,341 @@
+"""
+Precomputed attitude-to-torque lookup table.
+
+For a fixed geometry and centre of mass the drag torque of a step only depends on the particle
+direction in the body frame d, the angular velocity ω, the particle velocity v and a flow scale
+s = number density · flow speed · particle mass (the same for every direction):
+
+    τ = s (K(d) ω - c(d) × v)
+
+K(d) (3×3) and c(d) (3) are the collision-weighted second moment and mean of the lever arm over
+the faces hit from direction d. A TorqueTable evaluates them once on a grid of directions over the
+sphere, either in closed form (the expected collision model of the box geometry) or from a large
+number of sampled collisions (box or geometry.Mesh, including self-shadowing), and interpolates
+them in every step, so the cost of a step does not depend on the number of particles. It also
+tabulates the expected collisions per face.
+
+The grid is a cube sphere: every face of the cube is split into resolution × resolution cells in
+gnomonic coordinates and K, c and the collisions are interpolated bilinearly within a cell. The
+corners of a cell are evaluated just inside the cell, so the jumps of the box model where a face
+starts to be hit (the coordinate planes of the body frame) fall on cell edges and are not smeared.
+Directions exactly on a coordinate plane, e.g. the flow along a body axis at the start of a run,
+take the value of the model on the plane, which is tabulated separately along the centre lines of
+the cube faces and at the axes. The interpolation error is estimated by comparing the table with
+the model at random directions and at the axes, and reported as bounds on K and c, from which
+error_bound() bounds the torque error of a step.
+
+Tables are saved to .npz files named after a hash of the geometry and the build options, so each
+table is built once and loaded by later runs and sweep workers.
+
+Example:
+
+    table = lookup.TorqueTable.cached(__init__.sat_object, directory="tables")
+    table.errors                                    # Estimated interpolation error bounds
+    simulation.Simulation(torque_table=table, total_steps=10**7).run()
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import helpers
+import sampling
+import __init__
+
+
+face_order = list(__init__.face_normals)
+corner_offsets = np.array([[0, 0], [1, 0], [0, 1], [1, 1]])
+
+# Axis along the cube face and the two gnomonic coordinate axes of each of the six cube faces
+cube_axes = [(axis, [other for other in range(3) if other != axis]) for axis in range(3) for _ in (0, 1)]
+cube_signs = [1, -1] * 3
+
+
+def geometry_key(sat, mesh=None):
+    """Hash of the geometry a table depends on: the dimensions or the mesh, and the centre of mass."""
+    digest = hashlib.sha1()
+    if mesh is None:
+        digest.update(np.array([sat.length, sat.width, sat.height], dtype=float).tobytes())
+    else:
+        for array in (mesh.triangle_a, mesh.triangle_edges, mesh.triangle_face, mesh.face_body):
+            digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(np.asarray(sat.com, dtype=float).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def cell_directions(resolution, inset=1e-9):
+    """
+    Unit directions of the corners of every grid cell, just inside the cell.
+
+    :param resolution: Number of cells along each edge of a cube face
+    :param inset: Offset of the corners into their cell (gnomonic coordinates)
+    :return: (6, resolution, resolution, 4, 3) array of directions
+    """
+    edges = np.linspace(-1, 1, resolution + 1)
+    i, j = np.meshgrid(np.arange(resolution), np.arange(resolution), indexing="ij")
+    directions = np.empty((6, resolution, resolution, 4, 3))
+    for cube, (axis, (axis_u, axis_v)) in enumerate(cube_axes):
+        for corner, (di, dj) in enumerate(corner_offsets):
+            directions[cube, :, :, corner, axis] = cube_signs[cube]
+            directions[cube, :, :, corner, axis_u] = edges[i + di] + (inset if di == 0 else -inset)
+            directions[cube, :, :, corner, axis_v] = edges[j + dj] + (inset if dj == 0 else -inset)
+    return directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+
+
+def line_directions(resolution, inset=1e-9):
+    """
+    Unit directions of the segment ends of the two centre lines of every cube face, exactly on the
+    coordinate plane of the line and just inside the segment along it.
+
+    :return: (6, 2, resolution, 2, 3) array of directions; the first gnomonic coordinate of the
+             cube face is zero on line 0, the second on line 1
+    """
+    edges = np.linspace(-1, 1, resolution + 1)
+    k = np.arange(resolution)
+    directions = np.zeros((6, 2, resolution, 2, 3))
+    for cube, (axis, along) in enumerate(cube_axes):
+        for line in (0, 1):
+            for end in (0, 1):
+                directions[cube, line, :, end, axis] = cube_signs[cube]
+                directions[cube, line, :, end, along[1 - line]] = edges[k + end] + (inset if end == 0 else -inset)
+    return directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+
+
+def axis_directions():
+    """(6, 3) array of the unit directions along the axes, in the order of the cube faces."""
+    directions = np.zeros((6, 3))
+    for cube, (axis, _) in enumerate(cube_axes):
+        directions[cube, axis] = cube_signs[cube]
+    return directions
+
+
+def expected_coefficients(sat, directions):
+    """
+    K, c and the collisions per face of the box model (see helpers.compute_expected_torque()).
+
+    :param sat: Satellite object (dimensions and centre of mass)
+    :param directions: (N, 3) array of particle directions in the body frame
+    :return: (N, 3, 3) array of K, (N, 3) array of c and (N, 6) array of the collision weights
+             (probability times the total area of the faces hit) of the faces in face_order
+    """
+    normals = np.array([__init__.face_normals[face] for face in face_order], dtype=float)
+    areas = np.array([sat.surface_area[face] for face in face_order])
+    dots = np.maximum(directions @ normals.T, 0)
+    total_dots = dots.sum(axis=1, keepdims=True)
+    weights = np.divide(dots, total_dots, out=np.zeros_like(dots), where=total_dots > 0) \
+        * ((dots > 0) @ areas)[:, None]
+
+    mean_r, moment = zip(*(helpers.face_moments(face, sat) for face in face_order))
+    mean_r = np.array(mean_r)
+    moment = np.array([second_moment - np.trace(second_moment) * np.eye(3) for second_moment in moment])
+    return np.einsum("nf,fij->nij", weights, moment), weights @ mean_r, weights
+
+
+def sampled_coefficients(sat, directions, samples, rng, mesh=None):
+    """
+    K, c and the collisions per face estimated from sampled collisions (Sobol points for the box).
+
+    :param sat: Satellite object (dimensions and centre of mass)
+    :param directions: (N, 3) array of particle directions in the body frame
+    :param samples: Number of particles per direction
+    :param rng: numpy.random.Generator to draw from
+    :param mesh: Optional geometry.Mesh replacing the box (particles drawn by projected area, with self-shadowing)
+    :return: (N, 3, 3) array of K, (N, 3) array of c and (N, faces) array of the collision weights
+    """
+    num_faces = len(face_order) if mesh is None else len(mesh.face_names)
+    moments, means, face_weights = np.zeros((len(directions), 3, 3)), np.zeros((len(directions), 3)), \
+        np.zeros((len(directions), num_faces))
+    for n, direction in enumerate(directions):
+        if mesh is None:
+            dots = {face: np.dot(__init__.face_normals[face], direction) for face in face_order}
+            eligible = {face: dot for face, dot in dots.items() if dot > 0}
+            area = sum(sat.surface_area[face] for face in eligible)
+            total_dot = sum(eligible.values())
+            counts, points = sampling.sample_collisions({face: dot / total_dot for face, dot in eligible.items()},
+                                                        samples, sat, "sobol", rng)
+            faces = np.repeat([face_order.index(face) for face in eligible], counts)
+        else:
+            projected_areas, _ = mesh.projected_areas(np.eye(3), direction)
+            area = projected_areas.sum()
+            faces, points = mesh.sample_points(projected_areas, samples, rng)
+            lit = ~mesh.shadowed(points, faces, direction, projected_areas)
+            faces, points = faces[lit], points[lit]
+
+        r = points - sat.com
+        weight = area / samples  # Collision weight of one particle
+        means[n] = weight * r.sum(axis=0)
+        moments[n] = weight * (np.einsum("ni,nj->ij", r, r) - np.eye(3) * np.einsum("ni,ni->", r, r))
+        face_weights[n] = weight * np.bincount(faces, minlength=num_faces)
+    return moments, means, face_weights
+
+
+class TorqueTable:
+
+    def __init__(self, values, line_values, axis_values, faces, key, method="expected", samples=None, errors=None):
+        """
+        :param values: (6, resolution, resolution, 4, 12 + faces) array of the flattened K, c and
+                       collision weights at the corners of every cell (see build())
+        :param line_values: (6, 2, resolution, 2, 12 + faces) array of the values at the segment
+                            ends of the centre lines of the cube faces (see line_directions())
+        :param axis_values: (6, 12 + faces) array of the values at the axes (see axis_directions())
+        :param faces: Face names of the collision weights
+        :param key: geometry_key() of the geometry the table was built for
+        :param method: Evaluation method, "expected" or "sampled"
+        :param samples: Number of particles per direction of the sampled method
+        :param errors: Estimated interpolation error bounds (see build())
+        """
+        self.values = values
+        self.line_values = line_values
+        self.axis_values = axis_values
+        self.resolution = values.shape[1]
+        self.faces = list(faces)
+        self.key = key
+        self.method = method
+        self.samples = samples
+        self.errors = {} if errors is None else errors
+
+    @classmethod
+    def build(cls, sat, mesh=None, resolution=32, method="expected", samples=10**5, check_points=1000, seed=None):
+        """
+        Evaluate the torque coefficients on the grid and estimate the interpolation error.
+
+        :param sat: Satellite object (dimensions and centre of mass)
+        :param mesh: Optional geometry.Mesh replacing the box (needs method="sampled")
+        :param resolution: Number of cells along each edge of a cube face (6 resolution² cells), even
+                           so that the coordinate planes fall on cell edges
+        :param method: "expected" (closed form, box only) or "sampled"
+        :param samples: Number of particles per direction of the sampled method
+        :param check_points: Number of random directions the error is estimated at, besides the
+                             axes. With the sampled method the estimate includes the sampling noise
+                             of the table and of the reference.
+        :param seed: Seed of the sampled collisions and the check directions
+        """
+        if method not in ("expected", "sampled"):
+            raise ValueError(f"Unknown method {method!r}, expected 'expected' or 'sampled'")
+        if mesh is not None and method == "expected":
+            raise ValueError("A mesh needs method='sampled', the expected model is only available for the box")
+        if resolution % 2:
+            raise ValueError(f"The resolution must be even, got {resolution}")
+        rng = np.random.default_rng(seed)
+
+        def evaluate(directions):
+            if method == "expected":
+                return expected_coefficients(sat, directions)
+            return sampled_coefficients(sat, directions, samples, rng, mesh)
+
+        def tabulate(directions):
+            moments, means, face_weights = evaluate(directions.reshape(-1, 3))
+            values = np.concatenate([moments.reshape(-1, 9), means, face_weights], axis=1)
+            return values.reshape(directions.shape[:-1] + (-1,))
+
+        faces = face_order if mesh is None else mesh.face_names
+        table = cls(tabulate(cell_directions(resolution)), tabulate(line_directions(resolution)),
+                    tabulate(axis_directions()), faces, geometry_key(sat, mesh), method,
+                    samples if method == "sampled" else None)
+
+        # Largest deviation from the model at random directions and at the axes
+        check = rng.normal(size=(check_points, 3))
+        check /= np.linalg.norm(check, axis=1, keepdims=True)
+        check = np.concatenate([check, axis_directions()])
+        moments, means, _ = evaluate(check)
+        interpolated = np.array([table.interpolate(direction) for direction in check])
+        moment_error = np.linalg.norm(interpolated[:, :9] - moments.reshape(-1, 9), axis=1)
+        mean_error = np.linalg.norm(interpolated[:, 9:12] - means, axis=1)
+        table.errors = {
+            "moment": float(moment_error.max()),  # Frobenius norm bound of the error of K (m^4)
+            "mean": float(mean_error.max()),  # Bound of the error of c (m^3)
+            "relative_moment": float(moment_error.max() / np.linalg.norm(moments.reshape(-1, 9), axis=1).max()),
+            "relative_mean": float(mean_error.max() / np.linalg.norm(means, axis=1).max()),
+            "check_points": len(check),
+        }
+        return table
+
+    @classmethod
+    def cached(cls, sat, mesh=None, directory=".", **options):
+        """
+        Load the table of the geometry and build options from directory, or build and save it there.
+
+        :param options: Further arguments of build()
+        """
+        method = options.get("method", "expected")
+        name = f"torque_table_{geometry_key(sat, mesh)}_{method}_{options.get('resolution', 32)}"
+        if method == "sampled":
+            name += f"_{options.get('samples', 10**5)}_{options.get('seed')}"
+        path = os.path.join(directory, f"{name}.npz")
+        if os.path.exists(path):
+            return cls.load(path)
+        table = cls.build(sat, mesh, **options)
+        table.save(path)
+        return table
+
+    def save(self, path):
+        """
+        Save the table to an .npz file, written to a temporary file first and renamed, so that
+        concurrent sweep workers never read a partially written table.
+        """
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file:
+            np.savez(file, values=self.values, line_values=self.line_values, axis_values=self.axis_values,
+                     faces=np.array(self.faces), key=self.key, method=self.method,
+                     samples=-1 if self.samples is None else self.samples, errors=json.dumps(self.errors))
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a table saved by save()."""
+        with np.load(path) as data:
+            samples = int(data["samples"])
+            return cls(data["values"], data["line_values"], data["axis_values"], data["faces"].tolist(), data["key"].item(), data["method"].item(),
+                       None if samples < 0 else samples, json.loads(data["errors"].item()))
+
+    def interpolate(self, direction):
+        """
+        Bilinear interpolation of the table in the cell of a direction, or linear interpolation
+        along a centre line for a direction exactly on a coordinate plane.
+
+        :param direction: Particle direction in the body frame (need not be normalized)
+        :return: Array of the flattened K, c and collision weights
+        """
+        axis = int(np.argmax(np.abs(direction)))
+        cube = 2 * axis + (direction[axis] < 0)
+        axis_u, axis_v = cube_axes[cube][1]
+        if direction[axis_u] == 0 and direction[axis_v] == 0:
+            return self.axis_values[cube]
+
+        # Gnomonic coordinates in cell units, clamped to the cube face against rounding
+        scale = self.resolution / (2 * abs(direction[axis]))
+        x = min(max(direction[axis_u] * scale + self.resolution / 2, 0), self.resolution)
+        y = min(max(direction[axis_v] * scale + self.resolution / 2, 0), self.resolution)
+        if direction[axis_u] == 0 or direction[axis_v] == 0:
+            line, t = (0, y) if direction[axis_u] == 0 else (1, x)
+            k = min(int(t), self.resolution - 1)
+            ends = self.line_values[cube, line, k]
+            return (1 - (t - k)) * ends[0] + (t - k) * ends[1]
+
+        i, j = min(int(x), self.resolution - 1), min(int(y), self.resolution - 1)
+        fx, fy = x - i, y - j
+        corners = self.values[cube, i, j]
+        return ((1 - fx) * (1 - fy)) * corners[0] + (fx * (1 - fy)) * corners[1] \
+            + ((1 - fx) * fy) * corners[2] + (fx * fy) * corners[3]
+
+    def torque(self, body_direction, angular_velocity, particle_velocity, flow_scale):
+        """
+        Interpolated torque of one step.
+
+        :param body_direction: Particle direction in the body frame
+        :param angular_velocity: Angular velocity (rad/s)
+        :param particle_velocity: Velocity vector of the particles (m/s), as in compute_expected_torque()
+        :param flow_scale: Number density (m^-3) times flow speed (m/s) times particle mass (kg)
+        :return: Torque (N·m) and the array of collision weights (m²) of the faces
+        """
+        values = self.interpolate(body_direction)
+        torque = flow_scale * (values[:9].reshape(3, 3) @ angular_velocity - np.cross(values[9:12], particle_velocity))
+        return torque, values[12:]
+
+    def error_bound(self, angular_velocity, particle_velocity, flow_scale):
+        """
+        Estimated bound of the interpolation error of torque() (N·m), from the errors of K and c.
+        """
+        return flow_scale * (self.errors["moment"] * np.linalg.norm(angular_velocity)
+                             + self.errors["mean"] * np.linalg.norm(particle_velocity))
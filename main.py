@@ -1,5 +1,4 @@
 import numpy as np
-import random
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 import matplotlib.animation as animation
@@ -85,25 +84,22 @@ Delfi_n3xt = Satellite(
 )
 
 
-# Generate collision points for particles on each face
-def generate_collision_point(face):
+# Generate a batch of collision points on a given face
+def generate_collision_points(face, n):
     """
-    Generate a random collision point for a given face.
-    :param face: The face to generate collision point for.
-    :return: Collision point on the satellite surface (in meters).
+    Generate n uniformly distributed collision points on a given face in one call.
+    :param face: The face to generate collision points for.
+    :param n: Number of collision points.
+    :return: (n, 3) array of collision points on the satellite surface (in meters).
     """
-    if face == "+X":
-        return np.array([Delfi_n3xt.length,  random.uniform(0, Delfi_n3xt.width),  random.uniform(0, Delfi_n3xt.height)]) 
-    elif face == "-X":
-        return np.array([0,  random.uniform(0, Delfi_n3xt.width),  random.uniform(0, Delfi_n3xt.height)]) 
-    elif face == "+Y":
-        return np.array([ random.uniform(0, Delfi_n3xt.length), Delfi_n3xt.width, random.uniform(0, Delfi_n3xt.height)]) 
-    elif face == "-Y":
-        return np.array([ random.uniform(0, Delfi_n3xt.length), 0,  random.uniform(0, Delfi_n3xt.height)])
-    elif face == "+Z":
-        return np.array([ random.uniform(0, Delfi_n3xt.length),  random.uniform(0, Delfi_n3xt.width), Delfi_n3xt.height])
-    elif face == "-Z":
-        return np.array([ random.uniform(0, Delfi_n3xt.length),  random.uniform(0, Delfi_n3xt.width), 0])
+    dims = np.array([Delfi_n3xt.length, Delfi_n3xt.width, Delfi_n3xt.height])
+    axis = "XYZ".index(face[1])
+    points = rng.uniform(0, 1, (n, 3)) * dims
+    points[:, axis] = dims[axis] if face[0] == "+" else 0
+    return points
+
+# Random number generator used to draw the collisions of each timestep
+rng = np.random.default_rng()
 
 # Tracking particle collisions
 particle_counts = {face: [] for face in face_normals.keys()}
@@ -161,19 +157,18 @@ for step in range(total_steps):
         total_dot = sum(dot_products.values())
         total_surface = sum(Delfi_n3xt.surface_area.values())
         probabilities = {face: dp / total_dot for face, dp in dot_products.items()}
-        # Distribute particles across eligible faces based on probabilities
-        
-        for _ in range(num_particles):
-            face = random.choices(list(probabilities.keys()), weights=probabilities.values())[0]
-            collision_point = generate_collision_point(face)  # Random collision point
-            r = collision_point - Delfi_n3xt.com # Lever arm (in meters)
-            satellite_velocity = np.cross(r, Delfi_n3xt.angular_velocity)
-            relative_velocity = satellite_velocity - particle_velocity
-            force = (particle_mass * relative_velocity)/timestep
-            torque = np.cross(r, force)  # Torque due to one particle
-            total_torque += torque  # Accumulate torque
-            collisions_per_face[face] += 1  # Increment particle count for the selected face
-            collision_points.append(rotation_matrix @ (collision_point - [Delfi_n3xt.length/2, Delfi_n3xt.width/2, Delfi_n3xt.height/2]) + [0.005, 0.005, 0.01])
+        # Distribute particles across eligible faces based on probabilities (one multinomial draw per timestep)
+        faces = list(probabilities.keys())
+        counts = rng.multinomial(num_particles, list(probabilities.values()))
+        body_points = np.concatenate([generate_collision_points(face, count) for face, count in zip(faces, counts)])
+        r = body_points - Delfi_n3xt.com # Lever arms (in meters)
+        satellite_velocity = np.cross(r, Delfi_n3xt.angular_velocity)
+        relative_velocity = satellite_velocity - particle_velocity
+        force = (particle_mass * relative_velocity)/timestep
+        total_torque = np.cross(r, force).sum(axis=0)  # Torque due to all particles
+        for face, count in zip(faces, counts):
+            collisions_per_face[face] += int(count)
+        collision_points = (body_points - [Delfi_n3xt.length/2, Delfi_n3xt.width/2, Delfi_n3xt.height/2]) @ rotation_matrix.T + [0.005, 0.005, 0.01]
             
     # Angular acceleration: alpha = I^(-1) * total_torque
     angular_acceleration = np.linalg.inv(Delfi_n3xt.inertia_matrix).dot(total_torque)
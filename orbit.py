@@ -0,0 +1,198 @@
+"""
+Orbit and environment timeline of a run.
+
+The translational state of the satellite is propagated with Keplerian motion and the secular J2
+drift of the node, argument of perigee and mean anomaly, for all timesteps of a run in one
+vectorized pass before the attitude loop. The resulting Timeline holds per-step arrays of the
+velocity relative to the co-rotating atmosphere (the flow velocity, in the inertial frame),
+altitude, geodetic latitude and longitude, local solar time and number density, so the
+environment of a step is an array lookup.
+
+With a timeline, the global frame of the attitude is the inertial (ECI) frame, the particle
+direction of a step is the direction of its flow velocity and the flow velocity takes the place of
+particle_velocity. Unlike the constant particle_velocity, which the torque uses as given, the flow
+velocity is rotated into the body frame, in which the lever arms and the angular velocity are given.
+
+Example:
+
+    timeline = orbit.Orbit.from_altitudes(400, 800, inclination=98).timeline(timestep=1, total_steps=6000)
+    simulation.Simulation(timestep=1, total_steps=6000, timeline=timeline).run()
+"""
+
+from datetime import timedelta
+
+import numpy as np
+import helpers
+
+
+mu = 3.986004418e14  # Gravitational parameter of the Earth (m³/s²)
+earth_radius = 6378137.0  # Equatorial radius (m), WGS84
+flattening = 1 / 298.257223563  # WGS84
+j2 = 1.08262668e-3
+earth_rotation_rate = 7.2921159e-5  # rad/s
+
+
+def solve_kepler(mean_anomaly, eccentricity, iterations=10):
+    """Eccentric anomaly of an array of mean anomalies (Newton's method on E - e sin E = M)."""
+    eccentric_anomaly = mean_anomaly + eccentricity * np.sin(mean_anomaly)
+    for _ in range(iterations):
+        eccentric_anomaly -= ((eccentric_anomaly - eccentricity * np.sin(eccentric_anomaly) - mean_anomaly)
+                              / (1 - eccentricity * np.cos(eccentric_anomaly)))
+    return eccentric_anomaly
+
+
+def greenwich_sidereal_angle(epoch):
+    """Greenwich mean sidereal angle (rad) at a UTC datetime."""
+    days = (epoch - epoch.replace(year=2000, month=1, day=1, hour=12, minute=0, second=0, microsecond=0)
+            ).total_seconds() / 86400
+    return np.radians((280.46061837 + 360.98564736629 * days) % 360)
+
+
+def geodetic(position):
+    """
+    Geodetic latitude (rad) and height (m) above the WGS84 ellipsoid of Earth-fixed positions.
+    """
+    e2 = flattening * (2 - flattening)
+    p = np.hypot(position[:, 0], position[:, 1])
+    latitude = np.arctan2(position[:, 2], p * (1 - e2))
+    for _ in range(5):
+        n = earth_radius / np.sqrt(1 - e2 * np.sin(latitude)**2)
+        height = p / np.cos(latitude) - n
+        latitude = np.arctan2(position[:, 2], p * (1 - e2 * n / (n + height)))
+    n = earth_radius / np.sqrt(1 - e2 * np.sin(latitude)**2)
+    return latitude, p / np.cos(latitude) - n
+
+
+class Orbit:
+
+    def __init__(self, semi_major_axis, eccentricity=0.0, inclination=0.0, raan=0.0, argument_of_perigee=0.0,
+                 mean_anomaly=0.0):
+        """
+        Mean orbital elements at the start of the run.
+
+        :param semi_major_axis: Semi-major axis (m)
+        :param eccentricity: Eccentricity
+        :param inclination: Inclination (degrees)
+        :param raan: Right ascension of the ascending node (degrees)
+        :param argument_of_perigee: Argument of perigee (degrees)
+        :param mean_anomaly: Mean anomaly (degrees)
+        """
+        self.semi_major_axis = semi_major_axis
+        self.eccentricity = eccentricity
+        self.inclination = inclination
+        self.raan = raan
+        self.argument_of_perigee = argument_of_perigee
+        self.mean_anomaly = mean_anomaly
+
+    @classmethod
+    def from_altitudes(cls, perigee_altitude, apogee_altitude=None, **elements):
+        """Orbit with the given perigee and apogee altitudes (km) above the equatorial radius."""
+        apogee_altitude = perigee_altitude if apogee_altitude is None else apogee_altitude
+        perigee, apogee = earth_radius + perigee_altitude * 1e3, earth_radius + apogee_altitude * 1e3
+        return cls((perigee + apogee) / 2, (apogee - perigee) / (apogee + perigee), **elements)
+
+    def propagate(self, times):
+        """
+        Inertial position and velocity at the given times.
+
+        :param times: Array of times since the start (s)
+        :return: (N, 3) arrays of position (m) and velocity (m/s) in the inertial frame
+        """
+        a, e = self.semi_major_axis, self.eccentricity
+        i = np.radians(self.inclination)
+        p = a * (1 - e**2)
+        n = np.sqrt(mu / a**3)
+
+        # Secular J2 rates of the node, argument of perigee and mean anomaly
+        factor = 0.75 * n * j2 * (earth_radius / p)**2
+        raan = np.radians(self.raan) - 2 * factor * np.cos(i) * times
+        argument_of_perigee = np.radians(self.argument_of_perigee) + factor * (5 * np.cos(i)**2 - 1) * times
+        mean_anomaly = np.radians(self.mean_anomaly) + (n + factor * np.sqrt(1 - e**2) * (3 * np.cos(i)**2 - 1)) * times
+
+        eccentric_anomaly = solve_kepler(mean_anomaly, e)
+        true_anomaly = 2 * np.arctan2(np.sqrt(1 + e) * np.sin(eccentric_anomaly / 2),
+                                      np.sqrt(1 - e) * np.cos(eccentric_anomaly / 2))
+        radius = p / (1 + e * np.cos(true_anomaly))
+
+        # Perifocal position and velocity, rotated by the argument of perigee, inclination and node
+        zeros = np.zeros_like(times)
+        position_pqw = np.stack([radius * np.cos(true_anomaly), radius * np.sin(true_anomaly), zeros], axis=1)
+        velocity_pqw = np.sqrt(mu / p) * np.stack([-np.sin(true_anomaly), e + np.cos(true_anomaly), zeros], axis=1)
+
+        cos_o, sin_o = np.cos(raan), np.sin(raan)
+        cos_w, sin_w = np.cos(argument_of_perigee), np.sin(argument_of_perigee)
+        rotation = np.empty((len(times), 3, 3))
+        rotation[:, 0, 0] = cos_o * cos_w - sin_o * sin_w * np.cos(i)
+        rotation[:, 0, 1] = -cos_o * sin_w - sin_o * cos_w * np.cos(i)
+        rotation[:, 0, 2] = sin_o * np.sin(i)
+        rotation[:, 1, 0] = sin_o * cos_w + cos_o * sin_w * np.cos(i)
+        rotation[:, 1, 1] = -sin_o * sin_w + cos_o * cos_w * np.cos(i)
+        rotation[:, 1, 2] = -cos_o * np.sin(i)
+        rotation[:, 2, 0] = sin_w * np.sin(i)
+        rotation[:, 2, 1] = cos_w * np.sin(i)
+        rotation[:, 2, 2] = np.cos(i)
+        return np.einsum("nij,nj->ni", rotation, position_pqw), np.einsum("nij,nj->ni", rotation, velocity_pqw)
+
+    def timeline(self, timestep, total_steps, density_provider=None, epoch=None, density_every=1):
+        """
+        Environment of every timestep of a run, see Timeline.
+
+        :param timestep: Duration of one timestep (s)
+        :param total_steps: Number of timesteps
+        :param density_provider: density.DensityProvider (defaults to helpers.density_provider). If it
+                                 has an interpolation grid, the density is interpolated in altitude and
+                                 local solar time; otherwise the model is evaluated at the latitude and
+                                 longitude of the steps.
+        :param epoch: Start of the run (UTC datetime, defaults to the epoch of the density provider)
+        :param density_every: Evaluate the density model only every this many steps and interpolate
+                              its logarithm in between
+        """
+        return Timeline(self, timestep, total_steps, density_provider, epoch, density_every)
+
+
+class Timeline:
+
+    def __init__(self, orbit, timestep, total_steps, density_provider=None, epoch=None, density_every=1):
+        """Propagate the orbit and evaluate the environment of every timestep (see Orbit.timeline())."""
+        self.parameters = (orbit, timestep, total_steps, density_provider, epoch, density_every)
+        density_provider = helpers.density_provider if density_provider is None else density_provider
+        epoch = density_provider.inputs["epoch"] if epoch is None else epoch
+
+        self.time = np.arange(total_steps) * timestep
+        self.position, self.velocity = orbit.propagate(self.time)
+
+        # Velocity relative to the atmosphere co-rotating with the Earth
+        self.flow_velocity = self.velocity - np.cross([0, 0, earth_rotation_rate], self.position)
+        self.flow_speed = np.linalg.norm(self.flow_velocity, axis=1)
+        self.flow_direction = self.flow_velocity / self.flow_speed[:, None]
+
+        # Earth-fixed position, geodetic coordinates and mean local solar time
+        sidereal_angle = greenwich_sidereal_angle(epoch) + earth_rotation_rate * self.time
+        cos_g, sin_g = np.cos(sidereal_angle), np.sin(sidereal_angle)
+        fixed_position = np.stack([cos_g * self.position[:, 0] + sin_g * self.position[:, 1],
+                                   -sin_g * self.position[:, 0] + cos_g * self.position[:, 1],
+                                   self.position[:, 2]], axis=1)
+        latitude, height = geodetic(fixed_position)
+        self.latitude = np.degrees(latitude)
+        self.longitude = np.degrees(np.arctan2(fixed_position[:, 1], fixed_position[:, 0]))
+        self.altitude = height / 1e3
+        universal_time = (epoch.hour + epoch.minute / 60 + epoch.second / 3600) + self.time / 3600
+        self.local_solar_time = (universal_time + self.longitude / 15) % 24
+
+        if density_provider.log_density is not None:
+            self.number_density = density_provider.interpolate(self.altitude, self.local_solar_time)
+        else:
+            evaluated = np.unique(np.append(np.arange(0, total_steps, density_every), total_steps - 1))
+            log_density = np.log([density_provider.number_density(
+                epoch=epoch + timedelta(seconds=float(self.time[k])), altitude=float(self.altitude[k]),
+                latitude=float(self.latitude[k]), longitude=float(self.longitude[k]),
+                local_solar_time=float(self.local_solar_time[k])) for k in evaluated])
+            self.number_density = np.exp(np.interp(np.arange(total_steps), evaluated, log_density))
+
+    def __len__(self):
+        return len(self.time)
+
+    def __reduce__(self):
+        # Checkpoints store how to rebuild the timeline instead of its arrays, so their size does
+        # not grow with the run length
+        return Timeline, self.parameters
@@ -0,0 +1,288 @@
+"""
+Streaming, bounded-memory output of simulation runs.
+
+RunWriter appends the state of every timestep to one .npy file per quantity in fixed-size blocks,
+so memory use does not grow with the number of steps. The .npy header is written with a fixed size
+and its shape is updated in place after every block, so the files can be opened with
+np.load(path, mmap_mode="r") at any time, also while the run is still going.
+
+Collision points can be stored as (step, x, y, z) rows, optionally subsampled to a fixed number of
+points per step, and/or as a reservoir sample of fixed size over the whole run.
+
+Example:
+
+    writer = output.RunWriter("runs", "Delfi_n3xt", points_per_step=100)
+    reader = simulation.Simulation(total_steps=100000).run(writer=writer)
+    reader["angular_velocity"][-10:]            # Only the last rows are read from disk
+"""
+
+import bisect
+import json
+import os
+import struct
+
+import numpy as np
+
+
+header_size = 128  # Fixed .npy header size (bytes), large enough for any shape of the output arrays
+
+
+def _npy_header(dtype, shape):
+    """Version 1.0 .npy header padded to header_size bytes, so that it can be rewritten in place."""
+    header = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": tuple(shape)})
+    header = header.ljust(header_size - 10 - 1) + "\n"
+    return np.lib.format.magic(1, 0) + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class NpyAppender:
+
+    def __init__(self, path, row_shape=(), dtype=float, chunk_size=1024):
+        """
+        Open an .npy file to which rows are appended in blocks of chunk_size rows.
+
+        :param path: Path of the .npy file (overwritten)
+        :param row_shape: Shape of one row, e.g. (3,) for a vector per step
+        :param dtype: Data type of the array
+        :param chunk_size: Number of rows buffered in memory before they are written
+        """
+        self.path = path
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.buffer = np.empty((chunk_size,) + self.row_shape, dtype=self.dtype)
+        self.buffered = 0
+        self.written = 0
+
+        self.file = open(path, "wb")
+        self.file.write(_npy_header(self.dtype, (0,) + self.row_shape))
+
+    @property
+    def rows(self):
+        """Number of rows appended so far, including the buffered ones."""
+        return self.written + self.buffered
+
+    def append(self, row):
+        """Append one row."""
+        self.buffer[self.buffered] = row
+        self.buffered += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+    def extend(self, rows):
+        """Append several rows at once."""
+        rows = np.asarray(rows, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        if len(rows) >= len(self.buffer) - self.buffered:
+            self.flush()
+            self._write(rows)
+        else:
+            self.buffer[self.buffered:self.buffered + len(rows)] = rows
+            self.buffered += len(rows)
+
+    def flush(self):
+        """Write the buffered rows and update the shape in the header."""
+        if self.buffered:
+            self._write(self.buffer[:self.buffered])
+            self.buffered = 0
+
+    def _write(self, rows):
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(np.ascontiguousarray(rows).tobytes())
+        self.written += len(rows)
+        self.file.seek(0)
+        self.file.write(_npy_header(self.dtype, (self.written,) + self.row_shape))
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __getstate__(self):
+        """Pickle the file offset instead of the open file (see checkpoint.py), after syncing the file."""
+        self.flush()
+        os.fsync(self.file.fileno())
+        state = self.__dict__.copy()
+        del state["file"]
+        return state
+
+    def __setstate__(self, state):
+        """Reopen the file and drop rows written after the state was saved."""
+        self.__dict__.update(state)
+        self.file = open(self.path, "r+b")
+        self.file.truncate(header_size + self.written * self.dtype.itemsize * int(np.prod(self.row_shape)))
+        self.file.write(_npy_header(self.dtype, (self.written,) + self.row_shape))
+        self.file.flush()
+
+
+class RunWriter:
+
+    def __init__(self, directory, sim_id, faces=None, chunk_size=1024, points_per_step=0, reservoir_size=0, seed=None):
+        """
+        Open the output files of a run.
+
+        :param directory: Output directory (created if needed)
+        :param sim_id: Description of the simulation, used as file name prefix
+        :param faces: Face names of the particle count columns (defaults to the keys of __init__.face_normals)
+        :param chunk_size: Number of timesteps buffered in memory before they are written
+        :param points_per_step: Collision points stored per timestep, drawn at random without
+                                replacement (0 stores none, None stores all)
+        :param reservoir_size: Size of a uniform reservoir sample of collision points over the whole
+                               run, written on close (0 disables it)
+        :param seed: Seed of the point subsampling
+        """
+        if faces is None:
+            import __init__
+            faces = list(__init__.face_normals.keys())
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.sim_id = sim_id
+        self.faces = list(faces)
+        self.points_per_step = points_per_step
+        self.rng = np.random.default_rng(seed)
+
+        self.chunk_size = chunk_size
+
+        self.arrays = {
+            "step": self.appender("step", (), int),
+            "angular_velocity": self.appender("angular_velocity", (3,)),
+            "angular_acceleration": self.appender("angular_acceleration", (3,)),
+            "angles": self.appender("angles", (3,)),
+            "rotation_matrix": self.appender("rotation_matrix", (3, 3)),
+            "particle_counts": self.appender("particle_counts", (len(self.faces),)),
+        }
+        if points_per_step != 0:
+            # Rows of (step, x, y, z), sorted by step
+            self.arrays["collision_points"] = self.appender("collision_points", (4,))
+
+        self.reservoir = np.empty((reservoir_size, 4))
+        self.points_seen = 0
+        self.metadata = {}  # Further entries of the metadata file, e.g. the stop reason of the run
+
+    def appender(self, name, row_shape, dtype=float):
+        """Open the .npy file of a quantity."""
+        return NpyAppender(os.path.join(self.directory, f"{self.sim_id}_{name}.npy"), row_shape, dtype, self.chunk_size)
+
+    def write(self, step, angular_velocity, angular_acceleration, angles, rotation_matrix, particle_counts,
+              collision_points=None, **quantities):
+        """
+        Append the state of one timestep.
+
+        :param step: Index of the timestep, stored per row (rows and step indices differ after coarse steps)
+        :param angular_velocity: Angular velocity (rad/s)
+        :param angular_acceleration: Angular acceleration (rad/s²)
+        :param angles: Rotation angles (rad)
+        :param rotation_matrix: Rotation matrix from the body frame to the global frame
+        :param particle_counts: Collisions per face, in the order of the faces of the writer
+        :param collision_points: (n, 3) array of collision points in the global frame
+        :param quantities: Further per-timestep quantities, each stored in its own file, e.g. torque_stderr
+        """
+        self.arrays["step"].append(step)
+        self.arrays["angular_velocity"].append(angular_velocity)
+        self.arrays["angular_acceleration"].append(angular_acceleration)
+        self.arrays["angles"].append(angles)
+        self.arrays["rotation_matrix"].append(rotation_matrix)
+        self.arrays["particle_counts"].append(particle_counts)
+        for name, value in quantities.items():
+            if name not in self.arrays:
+                self.arrays[name] = self.appender(name, np.shape(value))
+            self.arrays[name].append(value)
+
+        if collision_points is None or not len(collision_points):
+            return
+        rows = np.column_stack([np.full(len(collision_points), step, dtype=float), collision_points])
+
+        if "collision_points" in self.arrays:
+            if self.points_per_step is not None and len(rows) > self.points_per_step:
+                rows_kept = rows[np.sort(self.rng.choice(len(rows), self.points_per_step, replace=False))]
+            else:
+                rows_kept = rows
+            self.arrays["collision_points"].extend(rows_kept)
+
+        if len(self.reservoir):
+            self._update_reservoir(rows)
+
+    def _update_reservoir(self, rows):
+        """Reservoir sampling (algorithm R) of a batch of rows."""
+        fill = min(len(rows), max(len(self.reservoir) - self.points_seen, 0))
+        self.reservoir[self.points_seen:self.points_seen + fill] = rows[:fill]
+
+        # Row i of the rest replaces a random reservoir entry with probability size / (rows seen + 1)
+        seen = self.points_seen + np.arange(fill, len(rows))
+        slots = self.rng.integers(0, seen + 1)
+        replaced = slots < len(self.reservoir)
+        self.reservoir[slots[replaced]] = rows[fill:][replaced]
+        self.points_seen += len(rows)
+
+    def flush(self):
+        """Write all buffered timesteps."""
+        for array in self.arrays.values():
+            array.flush()
+
+    def close(self):
+        """
+        Write the remaining timesteps, the reservoir sample and the metadata of the run.
+
+        :return: RunReader of the written output
+        """
+        for array in self.arrays.values():
+            array.close()
+        if len(self.reservoir):
+            np.save(os.path.join(self.directory, f"{self.sim_id}_collision_reservoir.npy"),
+                    self.reservoir[:min(self.points_seen, len(self.reservoir))])
+
+        with open(os.path.join(self.directory, f"{self.sim_id}_meta.json"), "w") as file:
+            json.dump(dict(self.metadata, faces=self.faces, steps=self.arrays["angular_velocity"].rows), file)
+
+        return RunReader(self.directory, self.sim_id)
+
+
+class RunReader:
+
+    def __init__(self, directory, sim_id):
+        """
+        Open the output of a run written by RunWriter. Arrays are memory-mapped, so only the rows
+        that are accessed are read from disk.
+
+        :param directory: Output directory of the run
+        :param sim_id: Description of the simulation (file name prefix)
+        """
+        self.directory = directory
+        self.sim_id = sim_id
+        meta_path = os.path.join(directory, f"{sim_id}_meta.json")
+        self.metadata = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                self.metadata = json.load(file)
+        self.faces = self.metadata.get("faces")
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{self.sim_id}_{name}.npy")
+
+    def __contains__(self, name):
+        return os.path.exists(self.path(name))
+
+    def __getitem__(self, name):
+        """Memory-mapped array of a quantity, e.g. reader["angular_velocity"]."""
+        return np.load(self.path(name), mmap_mode="r")
+
+    def iter_chunks(self, name, chunk_size=65536):
+        """Iterate over a quantity in blocks of chunk_size rows."""
+        array = self[name]
+        for start in range(0, len(array), chunk_size):
+            yield np.asarray(array[start:start + chunk_size])
+
+    def decimated(self, name, max_rows=10000):
+        """
+        Every n-th row of a quantity, with n chosen so that at most max_rows rows are returned.
+
+        :return: Indices of the returned rows and the rows
+        """
+        array = self[name]
+        stride = max(1, -(-len(array) // max_rows))
+        return np.arange(0, len(array), stride), np.asarray(array[::stride])
+
+    def collision_points(self, step):
+        """(n, 3) array of the collision points stored for one timestep."""
+        points = self["collision_points"]
+        steps = points[:, 0]  # Binary search on the memory-mapped column, without reading all of it
+        start, end = bisect.bisect_left(steps, step), bisect.bisect_left(steps, step + 1)
+        return np.asarray(points[start:end, 1:])
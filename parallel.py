@@ -0,0 +1,141 @@
+"""
+Parallel torque accumulation within a timestep.
+
+With a small simulated particle mass a single timestep can take millions of collisions. A
+ParallelTorque splits the particles of a step into one chunk per worker and draws and reduces the
+chunks on a persistent thread or process pool. Chunk k always uses random stream k, spawned from
+one seed with numpy.random.SeedSequence, and the partial torques, counts and sums of squares are
+added in chunk order, so the results are reproducible for a given seed and number of workers
+(but differ between worker counts).
+
+numpy releases the GIL in the random number generation and array arithmetic of a chunk, so threads
+scale with the number of cores for large chunks without copying the collision points. Processes
+avoid the GIL entirely, but the collision points have to be sent back; use return_points=False if
+they are not stored.
+
+Example:
+
+    with parallel.ParallelTorque(workers=8, seed=1) as torque:
+        results = simulation.Simulation(particle_mass=1e-15, parallel=torque).run()
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import sampling
+
+
+def _chunk_torque(face_counts, sat, particle_velocity, particle_mass, timestep, angular_velocity, rng, return_points):
+    """
+    Draw the collisions of one chunk and reduce them to torque sums.
+
+    :param face_counts: Dictionary of the number of particles of the chunk per face
+    :return: Sum and sum of squares of the particle torques, the number of particles, the collision
+             points (or None) and the random generator, advanced past the draws of the chunk
+    """
+    points = np.concatenate([sampling.face_points(face, count, sat, "random", rng)
+                             for face, count in face_counts.items()])
+    r = points - sat.com  # Lever arms (in meters)
+    force = particle_mass * (np.cross(r, angular_velocity) - particle_velocity) / timestep
+    torque = np.cross(r, force)
+    return torque.sum(axis=0), (torque**2).sum(axis=0), len(torque), points if return_points else None, rng
+
+
+class ParallelTorque:
+
+    def __init__(self, workers=None, seed=None, executor="thread", min_chunk_size=10000, return_points=True):
+        """
+        Set up the random streams of the workers; the pool is started on first use.
+
+        :param workers: Number of chunks and workers (defaults to the number of cores)
+        :param seed: Seed the random streams of the chunks are spawned from
+        :param executor: "thread" or "process"
+        :param min_chunk_size: Minimum number of particles per chunk. Steps with fewer than two chunks
+                               of particles are computed in the calling thread, still with stream 0.
+        :param return_points: Return the collision points of a step (not needed without output of them)
+        """
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor {executor!r}, expected 'thread' or 'process'")
+        self.workers = os.cpu_count() if workers is None else workers
+        self.executor = executor
+        self.min_chunk_size = min_chunk_size
+        self.return_points = return_points
+        self.rngs = [np.random.default_rng(stream) for stream in np.random.SeedSequence(seed).spawn(self.workers)]
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["pool"] = None  # Restarted on first use after a checkpoint is loaded
+        return state
+
+    def close(self):
+        """Shut the pool down."""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def split(self, counts, num_chunks):
+        """
+        Split the particle counts of the faces into chunks, the first chunks taking the remainders.
+
+        :param counts: Dictionary of the number of particles per face
+        :param num_chunks: Number of chunks
+        :return: List of dictionaries of the number of particles per face of each chunk
+        """
+        chunks = [{} for _ in range(num_chunks)]
+        for face, count in counts.items():
+            share, remainder = divmod(count, num_chunks)
+            for k, chunk in enumerate(chunks):
+                chunk[face] = share + (k < remainder)
+        return chunks
+
+    def compute_torque(self, probabilities, num_particles, sat, particle_velocity, particle_mass, timestep, rng,
+                       angular_velocity=None):
+        """
+        Parallel version of sampling.sample_collisions() and sampling.collision_torque() with random sampling.
+
+        :param rng: numpy.random.Generator of the simulation, used to distribute the particles over the
+                    faces (the points are drawn from the streams of the chunks)
+        :return: Total torque (N·m), collisions per face, the (N, 3) array of collision points (empty
+                 if return_points is False) and the standard error of the total torque per component (N·m)
+        """
+        angular_velocity = sat.angular_velocity if angular_velocity is None else angular_velocity
+        weights = np.array(list(probabilities.values()), dtype=float)
+        counts = dict(zip(probabilities.keys(), (int(count) for count in rng.multinomial(num_particles, weights / weights.sum()))))
+
+        num_chunks = int(min(self.workers, max(1, num_particles // self.min_chunk_size)))
+        arguments = [(chunk, sat, particle_velocity, particle_mass, timestep, angular_velocity, self.rngs[k],
+                      self.return_points) for k, chunk in enumerate(self.split(counts, num_chunks))]
+        if num_chunks == 1:
+            partials = [_chunk_torque(*arguments[0])]
+        else:
+            if self.pool is None:
+                pool_class = ThreadPoolExecutor if self.executor == "thread" else ProcessPoolExecutor
+                self.pool = pool_class(max_workers=self.workers)
+            partials = list(self.pool.map(_chunk_torque, *zip(*arguments)))
+
+        # Deterministic reduction in chunk order
+        total_torque, square_sum, n = np.zeros(3), np.zeros(3), 0
+        points = []
+        for k, (torque_sum, torque_square_sum, count, chunk_points, chunk_rng) in enumerate(partials):
+            total_torque += torque_sum
+            square_sum += torque_square_sum
+            n += count
+            if chunk_points is not None:
+                points.append(chunk_points)
+            self.rngs[k] = chunk_rng  # Processes return a copy of the advanced stream
+
+        # n Var(τ) of the particle torques, as for random sampling in sampling.collision_torque()
+        variance = np.zeros(3)
+        if n > 1:
+            variance = n * np.maximum(square_sum - total_torque**2 / n, 0) / (n - 1)
+        collision_points = np.concatenate(points) if points else np.empty((0, 3))
+        return total_torque, counts, collision_points, np.sqrt(variance)
@@ -0,0 +1,68 @@
+"""
+Plots of a run stored by output.RunWriter, as in main.py.
+
+The histories are read through output.RunReader and decimated to at most max_points points per
+curve, so runs of millions of steps can be plotted without loading them into memory.
+
+Example:
+
+    plotting.plot_run(output.RunReader("runs", "Delfi_n3xt"))
+
+The time axis is the stored time of every row, so runs with coarse (multi-rate) steps are plotted
+at the right times.
+"""
+
+import matplotlib.pyplot as plt
+
+
+def plot_particle_counts(reader, max_points=10000):
+    """
+    Plot the number of particles colliding with each surface per timestep.
+
+    :param reader: output.RunReader of the run
+    :param max_points: Maximum number of points per curve
+    """
+    _, counts = reader.decimated("particle_counts", max_points)
+    _, time = reader.decimated("time", max_points)
+
+    plt.figure(figsize=(12, 6))
+    for i, face in enumerate(reader.faces):
+        plt.plot(time, counts[:, i], label=f"Face {face}")
+
+    plt.title("Number of Particles Colliding with Each Surface per Timestep")
+    plt.xlabel("Time (in s)")
+    plt.ylabel("Number of Particles")
+    plt.legend()
+    plt.grid()
+    plt.show()
+
+
+def plot_angular_velocity_and_acceleration(reader, max_points=10000):
+    """
+    Plot the angular velocity and angular acceleration about the body axes.
+
+    :param reader: output.RunReader of the run
+    :param max_points: Maximum number of points per curve
+    """
+    fig, axes = plt.subplots(2, 1, figsize=(10, 8))
+    _, time = reader.decimated("time", max_points)
+
+    for ax, name, title, unit in [(axes[0], "angular_velocity", "Angular Velocity", "rad/s"),
+                                  (axes[1], "angular_acceleration", "Angular Acceleration", "rad/s²")]:
+        _, history = reader.decimated(name, max_points)
+        for i, axis in enumerate("XYZ"):
+            ax.plot(time, history[:, i], label=f'About {axis}-axis ({unit})')
+        ax.set_title(f'{title} Over Time')
+        ax.set_xlabel('Time (s)')
+        ax.set_ylabel(f'{title} ({unit})')
+        ax.legend()
+        ax.grid(True)
+
+    plt.tight_layout()
+    plt.show()
+
+
+def plot_run(reader, max_points=10000):
+    """Show all plots of a run."""
+    plot_particle_counts(reader, max_points)
+    plot_angular_velocity_and_acceleration(reader, max_points)
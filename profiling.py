@@ -0,0 +1,221 @@
+"""
+Instrumentation of the simulation step loop.
+
+A Profiler times the phases of every step (rotation matrix, face visibility, particle count,
+sampling, torque, integration, output) and counts steps, particles and torque evaluations. Phases
+can be nested; each phase reports its total time and its self time (without the phases nested in
+it), e.g. the integration phase of RK4 contains the torque evaluations of its four stages. The
+summary can be saved as JSON and the phases of every step as a Chrome trace (chrome://tracing or
+https://ui.perfetto.dev).
+
+Instrumentation is off by default: simulations then use null_profiler, whose phases are a shared
+no-op context manager, so the instrumented code costs one attribute lookup and an empty with
+statement per phase.
+
+ProgressLog replaces the periodic print of the solver with one JSON line per report, including the
+throughput since the previous report.
+
+Example:
+
+    profiler = profiling.Profiler(trace=True)
+    simulation.Simulation(total_steps=1000, profiler=profiler).run()
+    profiler.save_summary("profile.json")
+    profiler.save_trace("trace.json")
+"""
+
+import json
+import numbers
+import os
+import sys
+import threading
+import time
+
+
+class _Phase:
+    """Context manager timing one phase of a Profiler."""
+
+    __slots__ = ("profiler", "name", "start", "children")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.children = 0
+        self.profiler.stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        elapsed = end - self.start
+        profiler = self.profiler
+        profiler.stack.pop()
+        if profiler.stack:
+            profiler.stack[-1].children += elapsed
+
+        stats = profiler.phases.get(self.name)
+        if stats is None:
+            stats = profiler.phases[self.name] = [0, 0, 0]  # Calls, total and self time (ns)
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] += elapsed - self.children
+
+        if profiler.trace and len(profiler.events) < profiler.max_events:
+            profiler.events.append((self.name, self.start, elapsed))
+        return False
+
+
+class Profiler:
+
+    def __init__(self, trace=False, max_events=10**6):
+        """
+        Collect phase timings and counters.
+
+        :param trace: Also record every phase as an event of a Chrome trace
+        :param max_events: Maximum number of recorded trace events (later ones are dropped)
+        """
+        self.trace = trace
+        self.max_events = max_events
+        self.phases = {}
+        self.counters = {}
+        self.events = []
+        self.stack = []
+        self.start = time.perf_counter_ns()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["stack"] = []  # Phases open while a checkpoint is saved are not restored
+        return state
+
+    def phase(self, name):
+        """Context manager timing a phase, e.g. with profiler.phase("sampling"): ..."""
+        return _Phase(self, name)
+
+    def count(self, name, value=1):
+        """Add a value to a counter."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """
+        Summary of the collected timings.
+
+        :return: Dictionary with the wall time (s), the counters, the throughput in steps and
+                 particles per second, and per phase the number of calls, the total and self time
+                 (s), the mean time per call (µs) and the fraction of the wall time spent in the
+                 phase itself
+        """
+        wall_time = (time.perf_counter_ns() - self.start) / 1e9
+        phases = {}
+        for name, (calls, total, own) in sorted(self.phases.items(), key=lambda item: -item[1][2]):
+            phases[name] = {
+                "calls": calls,
+                "total_time": total / 1e9,
+                "self_time": own / 1e9,
+                "mean_time_us": total / calls / 1e3,
+                "fraction": own / 1e9 / wall_time if wall_time else 0.0,
+            }
+        return {
+            "wall_time": wall_time,
+            "counters": dict(self.counters),
+            "steps_per_second": self.counters.get("steps", 0) / wall_time if wall_time else 0.0,
+            "particles_per_second": self.counters.get("particles", 0) / wall_time if wall_time else 0.0,
+            "phases": phases,
+        }
+
+    def save_summary(self, path):
+        """Write summary() to a JSON file."""
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def save_trace(self, path):
+        """Write the recorded phases in the Chrome trace event format (complete events, times in µs)."""
+        pid, tid = os.getpid(), threading.get_ident()
+        events = [{"name": name, "ph": "X", "ts": (start - self.start) / 1e3, "dur": elapsed / 1e3,
+                   "pid": pid, "tid": tid}
+                  for name, start, elapsed in self.events]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+class _NullPhase:
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullProfiler:
+    """Profiler that records nothing, used when instrumentation is off."""
+
+    _phase = _NullPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, value=1):
+        pass
+
+
+null_profiler = NullProfiler()
+
+
+class ProgressLog:
+
+    def __init__(self, every=10, stream=None):
+        """
+        Structured progress log of a run: one JSON line every few steps.
+
+        :param every: Number of timesteps between reports
+        :param stream: Stream to write to (defaults to sys.stdout)
+        """
+        self.every = every
+        self.stream = stream
+        self.last_time = None
+        self.last_step = 0
+        self.particles = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["stream"] = None
+        state["last_time"] = None
+        return state
+
+    def update(self, step, timestep, angular_velocity, angular_acceleration, angles, particle_counts,
+               num_particles, torque_stderr=None, steps=1):
+        """
+        Count the particles of a timestep and report every `every` steps, starting with the first.
+
+        :param step: Index of the timestep, the last one of a coarse step
+        :param timestep: Duration of one timestep (s)
+        :param steps: Number of timesteps merged into the step; it is reported if any of them is due
+        """
+        self.particles += num_particles
+        now = time.perf_counter()
+        if step // self.every == (step - steps) // self.every:
+            return
+
+        record = {
+            "step": step + 1,
+            "time": (step + 1) * timestep,
+            "angular_velocity": [float(value) for value in angular_velocity],
+            "angular_acceleration": [float(value) for value in angular_acceleration],
+            "angles": [float(value) for value in angles],
+            # Sampled counts stay integers; the expected mode and torque tables give fractional counts
+            "particle_counts": {face: int(count) if isinstance(count, numbers.Integral) else float(count)
+                                for face, count in particle_counts.items()},
+        }
+        if torque_stderr is not None:
+            record["torque_stderr"] = [float(value) for value in torque_stderr]
+        if self.last_time is not None and now > self.last_time:
+            record["steps_per_second"] = (step - self.last_step) / (now - self.last_time)
+            record["particles_per_second"] = self.particles / (now - self.last_time)
+
+        stream = sys.stdout if self.stream is None else self.stream
+        stream.write(json.dumps(record) + "\n")
+        stream.flush()
+        self.last_time, self.last_step, self.particles = now, step, 0
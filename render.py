@@ -0,0 +1,237 @@
+"""
+Offline renderer of attitude and collision animations from stored run output.
+
+Frames are drawn from the rotation matrices and collision points that output.RunWriter stored
+during the run (run with points_per_step > 0, or --points-per-step with --output npy), so the run
+itself keeps nothing in memory for rendering. The step index, time and flow direction of every row
+and the satellite geometry are read from the stored output as well. The frames are split into blocks rendered in a
+process pool with the Agg backend, each worker reading its steps from the memory-mapped output and
+reusing one figure for its block. Collision points are decimated to at most max_points per frame.
+
+The frames are written as a PNG sequence, or encoded to a .gif (Pillow) or .mp4 (ffmpeg) video.
+A preview renders only every n-th stored row.
+
+Example:
+
+    python render.py runs Delfi_n3xt frames/                  # PNG sequence
+    python render.py runs Delfi_n3xt run.mp4 --every 10       # Preview video of every 10th row
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def satellite_faces(sat=None, mesh=None):
+    """
+    Polygons of the satellite surface relative to its centre of mass (body frame) and their colors.
+
+    :param sat: Satellite object giving the box dimensions and centre of mass (defaults to __init__.sat_object)
+    :param mesh: Optional geometry.Mesh replacing the box
+    :return: List of (k, 3) vertex arrays and list of colors
+    """
+    import geometry
+    import __init__
+
+    sat = __init__.sat_object if sat is None else sat
+    mesh = geometry.Mesh.box(sat.length, sat.width, sat.height) if mesh is None else mesh
+    polygons = [polygon - sat.com for polygon in mesh.polygons()]
+    return polygons, [__init__.face_colors.get(name, "lightgray") for name in mesh.face_names]
+
+
+def stored_satellite(reader):
+    """Satellite object of the geometry stored in the metadata of a run (None for older output)."""
+    import __init__
+
+    geometry = reader.metadata.get("satellite")
+    if geometry is None:
+        return None
+    base = __init__.sat_object
+    return __init__.Satellite(geometry["length"], geometry["width"], geometry["height"], geometry["com"],
+                              base.angular_velocity, base.inertia_matrix)
+
+
+def _render_block(directory, sim_id, rows, frame_numbers, polygons, colors, frame_dir, timestep, max_points,
+                  dpi, size):
+    """Render the frames of a block of output rows in a worker process."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+    import output
+
+    reader = output.RunReader(directory, sim_id)
+    rotation_matrices = reader["rotation_matrix"]
+    # Step index and time of every row, which differ from the row index after coarse steps
+    steps = reader["step"] if "step" in reader else None
+    times = reader["time"] if "time" in reader else None
+    flow_directions = reader["flow_direction"] if "flow_direction" in reader else None
+    has_points = "collision_points" in reader
+    extent = max(np.abs(np.concatenate(polygons)).max() * 1.2, 1e-3)
+
+    fig = plt.figure(figsize=size)
+    ax = fig.add_subplot(projection="3d")
+    for row, frame_number in zip(rows, frame_numbers):
+        ax.cla()
+        step = row if steps is None else int(steps[row])
+        rotation_matrix = np.asarray(rotation_matrices[row])
+        ax.add_collection3d(Poly3DCollection([polygon @ rotation_matrix.T for polygon in polygons],
+                                             facecolors=colors, edgecolors="black", alpha=0.4))
+        if has_points:
+            points = reader.collision_points(step)
+            if len(points) > max_points:
+                points = points[::-(-len(points) // max_points)]
+            ax.scatter(points[:, 0], points[:, 1], points[:, 2], s=2, c="black")
+        # Incoming particles, which hit the faces facing the flow direction (+X for the constant flow)
+        flow_direction = np.array([1.0, 0, 0]) if flow_directions is None else np.asarray(flow_directions[row])
+        ax.quiver(*(extent * flow_direction), *(-extent / 2 * flow_direction), color="gray")
+        ax.set_xlim(-extent, extent)
+        ax.set_ylim(-extent, extent)
+        ax.set_zlim(-extent, extent)
+        ax.set_xlabel("X (m)")
+        ax.set_ylabel("Y (m)")
+        ax.set_zlabel("Z (m)")
+        time = (step + 1) * timestep if times is None else float(times[row])
+        ax.set_title(f"t = {time:.2f} s")
+        fig.savefig(os.path.join(frame_dir, f"frame_{frame_number:06d}.png"), dpi=dpi)
+    plt.close(fig)
+    return len(rows)
+
+
+def render_frames(directory, sim_id, frame_dir, timestep=None, sat=None, mesh=None, every=1, max_points=2000,
+                  workers=None, block_size=50, dpi=100, size=(6, 6)):
+    """
+    Render the frames of a stored run to a PNG sequence frame_000000.png, frame_000001.png, ...
+
+    :param directory: Output directory of the run
+    :param sim_id: Description of the simulation (file name prefix)
+    :param frame_dir: Directory of the frames (created if needed)
+    :param timestep: Duration of one timestep (s), only used for output without stored times
+                     (defaults to the stored timestep, then to __init__.timestep)
+    :param sat: Satellite object of the run (defaults to the stored geometry, then to __init__.sat_object)
+    :param mesh: geometry.Mesh of the run, if it used one
+    :param every: Render every n-th stored row only (preview)
+    :param max_points: Maximum number of collision points drawn per frame
+    :param workers: Number of worker processes (defaults to the number of cores)
+    :param block_size: Number of frames rendered by a worker per task
+    :param dpi: Resolution of the frames
+    :param size: Size of the frames (inches)
+    :return: Number of rendered frames
+    """
+    import output
+    import __init__
+
+    reader = output.RunReader(directory, sim_id)
+    timestep = reader.metadata.get("timestep", __init__.timestep) if timestep is None else timestep
+    sat = stored_satellite(reader) if sat is None else sat
+
+    os.makedirs(frame_dir, exist_ok=True)
+    polygons, colors = satellite_faces(sat, mesh)
+    rows = np.arange(0, len(reader["rotation_matrix"]), every)
+    frame_numbers = np.arange(len(rows))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_render_block, directory, sim_id, rows[start:start + block_size],
+                                   frame_numbers[start:start + block_size], polygons, colors, frame_dir, timestep,
+                                   max_points, dpi, size)
+                   for start in range(0, len(rows), block_size)]
+        return sum(future.result() for future in futures)
+
+
+def _read_frames(paths):
+    """Load the frames one at a time, closing each file once it is read."""
+    from PIL import Image
+
+    for path in paths:
+        with Image.open(path) as frame:
+            frame.load()
+            yield frame
+
+
+def encode_video(frame_dir, path, fps=25):
+    """
+    Encode a PNG sequence to a video: .gif with Pillow, any other format (e.g. .mp4) with ffmpeg.
+    """
+    if path.lower().endswith(".gif"):
+        names = sorted(name for name in os.listdir(frame_dir) if name.startswith("frame_"))
+        frames = _read_frames([os.path.join(frame_dir, name) for name in names])
+        # The frames are streamed to Pillow, so that only one PNG file is open at a time
+        next(frames).save(path, save_all=True, append_images=frames, duration=1000 / fps, loop=0)
+        return
+
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg is needed to encode videos other than .gif")
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-framerate", str(fps),
+                    "-i", os.path.join(frame_dir, "frame_%06d.png"), "-pix_fmt", "yuv420p",
+                    "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", path], check=True)
+
+
+def render(directory, sim_id, path, timestep=None, fps=25, **options):
+    """
+    Render a stored run to a PNG sequence (path is a directory) or a video (path with a file extension).
+
+    :param options: Further arguments of render_frames()
+    :return: Number of rendered frames
+    """
+    if not os.path.splitext(path)[1]:
+        return render_frames(directory, sim_id, path, timestep, **options)
+
+    with tempfile.TemporaryDirectory() as frame_dir:
+        count = render_frames(directory, sim_id, frame_dir, timestep, **options)
+        encode_video(frame_dir, path, fps)
+    return count
+
+
+def main(argv=None):
+    import __init__
+
+    parser = argparse.ArgumentParser(description="Render the attitude and collisions of a run stored with --output npy")
+    parser.add_argument("directory", help="Output directory of the run")
+    parser.add_argument("sim_id", help="Description of the simulation (file name prefix)")
+    parser.add_argument("path", help="Directory of a PNG sequence, or a .gif / .mp4 video file")
+    parser.add_argument("--timestep", type=float,
+                        help="Duration of one timestep (s), for output without stored times or timestep")
+    parser.add_argument("--every", type=int, default=1, help="Render every n-th stored row only (preview)")
+    parser.add_argument("--max-points", type=int, default=2000, help="Maximum number of collision points per frame")
+    parser.add_argument("--workers", type=int, help="Number of worker processes")
+    parser.add_argument("--fps", type=int, default=25, help="Frames per second of a video")
+    parser.add_argument("--dpi", type=int, default=100, help="Resolution of the frames")
+    parser.add_argument("--mesh", help="Wavefront .obj file of the satellite surface, if the run used one")
+    parser.add_argument("--mesh-scale", type=float, default=1.0, help="Factor converting the .obj coordinates to meters")
+    parser.add_argument("--length", type=float, help="Length of the satellite (m), for output without stored geometry")
+    parser.add_argument("--width", type=float, help="Width of the satellite (m), for output without stored geometry")
+    parser.add_argument("--height", type=float, help="Height of the satellite (m), for output without stored geometry")
+    parser.add_argument("--com", type=float, nargs=3, metavar=("X", "Y", "Z"),
+                        help="Centre of mass of the satellite (m), for output without stored geometry")
+    args = parser.parse_args(argv)
+
+    import output
+
+    reader = output.RunReader(args.directory, args.sim_id)
+    if reader.metadata.get("mesh") and args.mesh is None:
+        parser.error("the run used a mesh, pass its .obj file with --mesh")
+
+    # Stored geometry of the run, with the given dimensions replacing the stored (or default) ones
+    sat = stored_satellite(reader) or __init__.sat_object
+    dimensions = {name: getattr(args, name) for name in ("length", "width", "height", "com")}
+    dimensions = {name: getattr(sat, name) if value is None else value for name, value in dimensions.items()}
+    sat = __init__.Satellite(dimensions["length"], dimensions["width"], dimensions["height"], dimensions["com"],
+                             sat.angular_velocity, sat.inertia_matrix)
+
+    mesh = None
+    if args.mesh is not None:
+        import geometry
+
+        mesh = geometry.Mesh.load_obj(args.mesh, args.mesh_scale)
+    count = render(args.directory, args.sim_id, args.path, args.timestep, args.fps, sat=sat, mesh=mesh,
+                   every=args.every, max_points=args.max_points, workers=args.workers, dpi=args.dpi)
+    print(f"Rendered {count} frames to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
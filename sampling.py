@@ -0,0 +1,170 @@
+"""
+Collision sampling strategies and torque standard-error estimates.
+
+Three ways of drawing the collision points of a timestep:
+
+    "random"      Faces drawn with one multinomial draw and uniform random points
+                  (helpers.generate_collision_points()).
+    "stratified"  Particles split between faces by deterministic proportional allocation and
+                  jittered-grid points on each face.
+    "sobol"       Proportional allocation and scrambled Sobol points on each face.
+
+Every strategy also returns the standard error of the sampled torque. For random sampling it is
+estimated from the spread of the particle torques. The Sobol points of a face are split into
+sobol_replicates independently randomized point sets, and the spread of their torque sums gives an
+estimate of the actual (much smaller) quasi-Monte Carlo error. For stratified sampling the points
+on a face are treated as independent, so its estimate is an upper bound of the actual error.
+"""
+
+import functools
+
+import numpy as np
+import helpers
+
+
+sobol_replicates = 4  # Independently randomized Sobol point sets per face
+
+
+@functools.lru_cache(maxsize=None)
+def _sobol_sequence(m):
+    """First 2^m points of a scrambled two-dimensional Sobol sequence."""
+    from scipy.stats import qmc  # Imported on first use only
+
+    return qmc.Sobol(2, scramble=True, seed=0).random_base2(m)
+
+
+def allocate(probabilities, num_particles):
+    """
+    Split particles between faces in proportion to their probabilities (largest remainder method).
+    :param probabilities: Dictionary of collision probabilities of the eligible faces.
+    :param num_particles: Number of particles to split.
+    :return: Array of particle counts in the order of the probabilities.
+    """
+    quotas = num_particles * np.array(list(probabilities.values()), dtype=float) / sum(probabilities.values())
+    counts = np.floor(quotas).astype(int)
+    remainder = num_particles - counts.sum()
+    counts[np.argsort(counts - quotas)[:remainder]] += 1  # Largest fractional parts first
+    return counts
+
+
+def unit_square_points(n, method, rng):
+    """
+    Draw n points in the unit square.
+    :param n: Number of points.
+    :param method: "random", "stratified" (jittered grid) or "sobol" (scrambled Sobol sequence).
+    :param rng: numpy.random.Generator to draw from.
+    :return: (n, 2) array of points.
+    """
+    if method == "sobol":
+        # Scrambled Sobol points randomized by a random shift modulo 1 (Cranley-Patterson rotation),
+        # which keeps their low discrepancy and makes every draw an unbiased estimate
+        points = _sobol_sequence(int(np.ceil(np.log2(max(n, 1)))))[:n]
+        return (points + rng.uniform(0, 1, 2)) % 1
+
+    if method == "stratified":
+        # One jittered point in each cell of a k x k grid, the remaining points uniformly at random
+        k = int(np.sqrt(n))
+        cells = np.stack(np.divmod(np.arange(k*k), k), axis=1)
+        grid_points = (cells + rng.uniform(0, 1, (k*k, 2))) / max(k, 1)
+        return np.concatenate([grid_points, rng.uniform(0, 1, (n - k*k, 2))])
+
+    return rng.uniform(0, 1, (n, 2))
+
+
+def replicate_sizes(n):
+    """Sizes of the independently randomized Sobol point sets that n points of a face are split into."""
+    return np.diff(np.linspace(0, n, sobol_replicates + 1).astype(int))
+
+
+def face_points(face, n, sat, method, rng):
+    """
+    Draw n collision points on a face with the given sampling method.
+    :return: (n, 3) array of collision points on the satellite surface (in meters), for "sobol"
+             ordered by replicate point set.
+    """
+    if method == "random":
+        return helpers.generate_collision_points(face, n, sat, rng)
+
+    dims = np.array([sat.length, sat.width, sat.height])
+    axis = helpers.face_axes[face[1]]
+    in_plane = [i for i in range(3) if i != axis]
+
+    if method == "sobol":
+        unit_points = np.concatenate([unit_square_points(size, method, rng) for size in replicate_sizes(n)])
+    else:
+        unit_points = unit_square_points(n, method, rng)
+
+    points = np.empty((n, 3))
+    points[:, in_plane] = unit_points * dims[in_plane]
+    points[:, axis] = dims[axis] if face[0] == "+" else 0
+    return points
+
+
+def sample_collisions(probabilities, num_particles, sat, method="random", rng=None):
+    """
+    Distribute the particles of one timestep over the eligible faces and draw their collision points.
+
+    :param probabilities: Dictionary of collision probabilities of the eligible faces.
+    :param num_particles: Number of simulated particles colliding in this timestep.
+    :param sat: Satellite object (dimensions).
+    :param method: "random", "stratified" or "sobol".
+    :param rng: numpy.random.Generator to draw from (defaults to helpers.random_generator).
+    :return: Array of particle counts in the order of the probabilities and the (N, 3) array of
+             collision points, ordered by face.
+    """
+    rng = helpers.random_generator if rng is None else rng
+
+    if method == "random":
+        weights = np.array(list(probabilities.values()), dtype=float)
+        counts = rng.multinomial(num_particles, weights / weights.sum())
+    else:
+        counts = allocate(probabilities, num_particles)
+
+    collision_points = np.concatenate([face_points(face, count, sat, method, rng)
+                                       for face, count in zip(probabilities.keys(), counts)])
+    return counts, collision_points
+
+
+def collision_torque(collision_points, counts, sat, particle_velocity, particle_mass, timestep, method="random",
+                     angular_velocity=None):
+    """
+    Total torque of a batch of collisions and its standard error.
+
+    :param collision_points: (N, 3) array of collision points, ordered by face (see sample_collisions()).
+    :param counts: Particle counts of the faces.
+    :param sat: Satellite object (centre of mass and angular velocity).
+    :param particle_velocity: Velocity vector of the particles (m/s).
+    :param particle_mass: Simulated mass of one particle (kg).
+    :param timestep: Duration of the timestep (s).
+    :param method: Sampling method the points were drawn with.
+    :param angular_velocity: Angular velocity to evaluate the torque at (defaults to sat.angular_velocity).
+    :return: Total torque (N·m) and its standard error per component (N·m).
+    """
+    angular_velocity = sat.angular_velocity if angular_velocity is None else angular_velocity
+
+    r = collision_points - sat.com  # Lever arms (in meters)
+    satellite_velocity = np.cross(r, angular_velocity)
+    relative_velocity = satellite_velocity - particle_velocity
+    force = (particle_mass * relative_velocity)/timestep
+    torque = np.cross(r, force)  # Torque due to each particle
+    total_torque = torque.sum(axis=0)
+
+    # Variance of the total torque: n Var(τ) when the faces are drawn at random, the sum of
+    # n_f Var_f(τ) over the faces with a fixed allocation, and for Sobol points the sum over the faces
+    # of R Var(S_r) for the torque sums S_r of the R randomized point sets of a face
+    variance = np.zeros(3)
+    if method == "random":
+        if len(torque) > 1:
+            variance = len(torque) * torque.var(axis=0, ddof=1)
+    else:
+        for face_torque in np.split(torque, np.cumsum(counts)[:-1]):
+            if method == "sobol":
+                sizes = replicate_sizes(len(face_torque))
+                if sizes.min() > 0:
+                    replicate_sums = np.add.reduceat(face_torque, np.cumsum(sizes) - sizes)
+                    variance += sobol_replicates * replicate_sums.var(axis=0, ddof=1)
+            elif len(face_torque) > 1:
+                variance += len(face_torque) * face_torque.var(axis=0, ddof=1)
+
+    return total_torque, np.sqrt(variance)
+
@@ -0,0 +1,594 @@
+"""
+Importable simulation API.
+
+All the state of a run (satellite, attitude, random generator, step index) is held by a Simulation
+object, so a simulation can be run several times in one process or inside a worker without touching
+module globals. Importing this module does not evaluate the density model or ask for input.
+
+Example:
+
+    results = simulation.run({"length": 0.3, "com": [0.1, 0.05, 0.05], "total_steps": 1000, "seed": 1})
+    results["angular_velocity"]     # (1000, 3) array
+"""
+
+import copy
+
+import numpy as np
+import attitude
+import checkpoint
+import convergence
+import helpers
+import lookup
+import profiling
+import sampling
+import __init__
+
+
+# Keys of a run() configuration that describe the satellite, the rest are passed on to Simulation
+satellite_parameters = ("length", "width", "height", "com", "initial_angular_velocity", "inertia_matrix", "sim_id")
+
+
+class Simulation:
+
+    def __init__(self, sat=None, timestep=None, total_steps=None, collision_mode=None, angles=None, seed=None,
+                 particle_velocity=None, particle_mass=None, actual_particle_mass=None, density_provider=None,
+                 integrator=None, rtol=1e-6, atol=1e-9, sampling=None, torque_tolerance=None, min_particles=100,
+                 max_particles=10**7, verbose=False, profiler=None, mesh=None, parallel=None, timeline=None,
+                 monitor=None, multirate=None, torque_table=None):
+        """
+        Initialize a simulation. Parameters that are not given default to the values in __init__.py.
+
+        :param sat: Satellite object, copied so that the simulation does not modify it (defaults to __init__.sat_object)
+        :param timestep: Duration of one timestep (s)
+        :param total_steps: Number of timesteps of run()
+        :param collision_mode: "monte_carlo" (sampled particles) or "expected" (closed-form expected torque)
+        :param angles: Initial rotation angles [theta_x, theta_y, theta_z] (rad)
+        :param seed: Seed of the random generator used to sample the collisions
+        :param particle_velocity: Velocity vector of the particles (m/s)
+        :param particle_mass: Simulated mass of one particle (kg)
+        :param actual_particle_mass: Actual mass of one particle (kg)
+        :param density_provider: density.DensityProvider giving the particle number density
+        :param integrator: "euler" (explicit Euler on the angles, as originally), "rk4" or "rk45"
+                           (quaternion attitude with the full Euler rigid-body equations, see attitude.py).
+                           The error control of rk45 needs a smooth torque, so use it with the expected
+                           collision mode; with sampled particles it falls back to its minimum substep.
+        :param rtol: Relative tolerance of the rk45 integrator
+        :param atol: Absolute tolerance of the rk45 integrator
+        :param sampling: Collision sampling method, "random", "stratified" or "sobol" (see sampling.py)
+        :param torque_tolerance: Target standard error of the sampled torque (N·m). If given, the number
+                                 of particles of each timestep is the smallest that meets it according
+                                 to the running standard-error estimate, and the simulated particle mass
+                                 is adapted so that the total colliding mass stays the same.
+        :param min_particles: Lower bound of the particle count chosen for torque_tolerance
+        :param max_particles: Upper bound of the particle count chosen for torque_tolerance
+        :param verbose: Log the state and throughput every 10 timesteps (see profiling.ProgressLog)
+        :param profiler: profiling.Profiler timing the phases of every step (instrumentation is off if not given)
+        :param mesh: geometry.Mesh of the satellite surface in the body frame of sat, replacing the
+                     box of sat's dimensions (random sampling and the monte_carlo collision mode only,
+                     unless a torque table is given)
+        :param parallel: parallel.ParallelTorque drawing the particles of each step in chunks on a
+                         pool of workers (box geometry and random sampling only)
+        :param timeline: orbit.Timeline giving the flow velocity and density of every timestep, which
+                         replace particle_velocity and the density provider; the global frame is then
+                         the inertial frame
+        :param monitor: convergence.ConvergenceMonitor checking the run for a steady state, and
+                        stopping it once converged if its stop option is set
+        :param multirate: convergence.MultiRate merging timesteps into coarse steps while the
+                          dynamics are quiescent (uses the monitor, or a non-stopping one if not given)
+        :param torque_table: lookup.TorqueTable of the geometry (box of sat or mesh) and centre of mass,
+                             interpolated instead of evaluating the collision model in every step
+        """
+        self.sat = copy.deepcopy(__init__.sat_object if sat is None else sat)
+        self.timestep = __init__.timestep if timestep is None else timestep
+        self.total_steps = __init__.total_steps if total_steps is None else total_steps
+        self.collision_mode = __init__.collision_mode if collision_mode is None else collision_mode
+        self.angles = np.zeros(3) if angles is None else np.array(angles, dtype=float)
+        self.rng = np.random.default_rng(seed)
+        self.particle_velocity = np.array(__init__.particle_velocity if particle_velocity is None else particle_velocity, dtype=float)
+        self.particle_mass = __init__.particle_mass if particle_mass is None else particle_mass
+        self.actual_particle_mass = __init__.actual_particle_mass if actual_particle_mass is None else actual_particle_mass
+        self.density_provider = helpers.density_provider if density_provider is None else density_provider
+        self.integrator = __init__.integrator if integrator is None else integrator
+        self.rtol = rtol
+        self.atol = atol
+        self.sampling = __init__.sampling if sampling is None else sampling
+        self.torque_tolerance = __init__.torque_tolerance if torque_tolerance is None else torque_tolerance
+        self.min_particles = min_particles
+        self.max_particles = max_particles
+        self.verbose = verbose
+        self.progress = profiling.ProgressLog() if verbose else None
+        self.profiler = profiling.null_profiler if profiler is None else profiler
+
+        # Running estimate of the variance of the torque per particle and unit mass, and the
+        # standard error and particle count of the last sampled torque
+        self.torque_variance = None
+        self.torque_stderr = np.zeros(3)
+        self.num_particles = 0
+
+        # The inertia matrix is constant, so it is only inverted once
+        self.inverse_inertia = np.linalg.inv(self.sat.inertia_matrix)
+        if self.integrator != "euler":
+            self.quaternion = attitude.quaternion_from_angles(self.angles)
+            self.step_size = None  # Substep size carried over between timesteps by rk45
+
+        self.mesh = mesh
+        if mesh is not None:
+            if torque_table is None and (self.collision_mode == "expected" or self.sampling != "random"):
+                raise ValueError("A mesh geometry requires the monte_carlo collision mode and random sampling")
+            self.faces = list(mesh.face_names)
+        else:
+            self.faces = list(__init__.face_normals.keys())
+        self.parallel = parallel
+        self.timeline = timeline
+        if multirate is not None and monitor is None:
+            monitor = convergence.ConvergenceMonitor(stop=False)
+        self.monitor = monitor
+        self.multirate = multirate
+        self.history_rows = 0  # Rows of the results of run() filled so far
+        if parallel is not None and (mesh is not None or self.sampling != "random"):
+            raise ValueError("Parallel torque accumulation requires the box geometry and random sampling")
+        self.torque_table = torque_table
+        if torque_table is not None:
+            if parallel is not None:
+                raise ValueError("A torque table replaces the collision sampling, it cannot be used with parallel")
+            if torque_table.key != lookup.geometry_key(self.sat, mesh):
+                raise ValueError("The torque table was built for another geometry or centre of mass")
+        self.step_index = 0
+
+    def compute_torque(self, rotation_matrix, angular_velocity=None):
+        """
+        Compute the drag torque for the current attitude and angular velocity.
+
+        :param rotation_matrix: Rotation matrix from the body frame to the global frame
+        :param angular_velocity: Angular velocity to evaluate the torque at (defaults to the current one)
+        :return: Total torque (N·m), collisions per face and the collision points in the global
+                 frame relative to the centre of mass (empty in expected mode)
+        """
+        if self.torque_table is not None:
+            return self._compute_table_torque(rotation_matrix, angular_velocity)
+        if self.mesh is not None:
+            return self._compute_mesh_torque(rotation_matrix, angular_velocity)
+
+        profiler = self.profiler
+        profiler.count("torque_evaluations")
+        total_torque = np.zeros(3)
+        collisions_per_face = {face: 0 for face in self.faces}
+        collision_points = np.empty((0, 3))
+        sum_surface = 0
+
+        particle_velocity, particle_direction, speed, number_density = self.environment(rotation_matrix)
+
+        # Calculate dot products and probabilities
+        with profiler.phase("visibility"):
+            dot_products = {}
+            for face, normal in __init__.face_normals.items():
+                global_normal = rotation_matrix @ normal  # Rotate normal to global frame
+                dot_product = np.dot(global_normal, particle_direction)
+                if dot_product > 0:  # Consider only faces eligible for collision
+                    dot_products[face] = dot_product
+                    sum_surface += self.sat.surface_area[face]
+
+        with profiler.phase("particle_count"):
+            #Compute actual number of particles colliding with satellite per timestep based on density model
+            actual_num_particles = number_density * 10**6 * speed * self.timestep * sum_surface
+
+            #Compute simulated number of particles based on arbitrary simulated particle mass
+            expected_num_particles = actual_num_particles * self.actual_particle_mass / self.particle_mass
+            num_particles = int(np.ceil(expected_num_particles))
+
+        if dot_products:
+            # Normalize dot products to probabilities
+            total_dot = sum(dot_products.values())
+            probabilities = {face: dp / total_dot for face, dp in dot_products.items()}
+            if self.collision_mode == "expected":
+                # Integrate the torque over the eligible faces in closed form (no sampling noise)
+                with profiler.phase("torque"):
+                    total_torque, collisions_per_face_drawn = helpers.compute_expected_torque(
+                        probabilities, expected_num_particles, self.sat, particle_velocity,
+                        self.particle_mass, self.timestep, angular_velocity)
+            else:
+                num_particles, particle_mass = self._sampled_particles(expected_num_particles, num_particles)
+
+                if self.parallel is not None:
+                    # Sampling and torque of the chunks of particles run together on the workers
+                    with profiler.phase("parallel_torque"):
+                        total_torque, collisions_per_face_drawn, body_points, self.torque_stderr = self.parallel.compute_torque(
+                            probabilities, num_particles, self.sat, particle_velocity, particle_mass,
+                            self.timestep, self.rng, angular_velocity)
+                        collision_points = (body_points - self.sat.com) @ rotation_matrix.T
+                else:
+                    # Distribute particles across eligible faces and accumulate their torque in one batch
+                    with profiler.phase("sampling"):
+                        counts, body_points = sampling.sample_collisions(probabilities, num_particles, self.sat,
+                                                                         self.sampling, self.rng)
+                    with profiler.phase("torque"):
+                        total_torque, self.torque_stderr = sampling.collision_torque(
+                            body_points, counts, self.sat, particle_velocity, particle_mass, self.timestep,
+                            self.sampling, angular_velocity)
+                        collision_points = (body_points - self.sat.com) @ rotation_matrix.T
+                    collisions_per_face_drawn = {face: int(count) for face, count in zip(probabilities, counts)}
+                self._update_torque_variance(num_particles, particle_mass)
+            collisions_per_face.update(collisions_per_face_drawn)
+
+        return total_torque, collisions_per_face, collision_points
+
+    def environment(self, rotation_matrix):
+        """
+        Flow of the current timestep.
+
+        :param rotation_matrix: Rotation matrix from the body frame to the global frame
+        :return: Particle velocity of the torque (m/s), unit particle direction in the global frame,
+                 flow speed (m/s) and number density (cm^-3), from the timeline if one is given. The
+                 flow velocity of the timeline is rotated into the body frame, in which the lever
+                 arms and the angular velocity are given; the constant particle_velocity is used as
+                 given, as in the original model.
+        """
+        if self.timeline is not None:
+            step = self.step_index
+            return (rotation_matrix.T @ self.timeline.flow_velocity[step], self.timeline.flow_direction[step],
+                    self.timeline.flow_speed[step], self.timeline.number_density[step])
+
+        # Particles moving along +X in global frame
+        return self.particle_velocity, np.array([1, 0, 0]), self.particle_velocity[0], self.density_provider.number_density()
+
+    def _sampled_particles(self, expected_num_particles, num_particles):
+        """
+        Number of particles to sample in a timestep and the simulated mass of one particle.
+
+        :param expected_num_particles: Expected number of simulated particles of the timestep
+        :param num_particles: Particle count set by the particle mass
+        :return: The particle count (the smallest that meets the torque tolerance, if one is set) and
+                 the particle mass that keeps the total colliding mass unchanged
+        """
+        if self.torque_tolerance is None or self.torque_variance is None:
+            return num_particles, self.particle_mass
+
+        # Smallest particle count with standard error M sqrt(σ² / n) below the tolerance,
+        # for the total colliding mass M of this timestep
+        total_mass = expected_num_particles * self.particle_mass
+        num_particles = int(np.clip(np.ceil(total_mass**2 * self.torque_variance / self.torque_tolerance**2),
+                                    self.min_particles, self.max_particles))
+        return num_particles, total_mass / num_particles
+
+    def _update_torque_variance(self, num_particles, particle_mass):
+        """Record the particle count of a sampled torque and update the running variance estimate."""
+        self.num_particles = num_particles
+        self.profiler.count("particles", num_particles)
+
+        # Exponential moving average of the variance per particle and unit mass
+        if num_particles > 1:
+            variance = (self.torque_stderr**2).sum() / (num_particles * particle_mass**2)
+            self.torque_variance = variance if self.torque_variance is None else 0.8 * self.torque_variance + 0.2 * variance
+
+    def _compute_mesh_torque(self, rotation_matrix, angular_velocity=None):
+        """
+        compute_torque() for a geometry.Mesh: particles are drawn over the faces in proportion to
+        their projected area and those shadowed by another body are removed.
+        """
+        profiler = self.profiler
+        profiler.count("torque_evaluations")
+        total_torque = np.zeros(3)
+        collisions_per_face = {face: 0 for face in self.faces}
+        collision_points = np.empty((0, 3))
+
+        particle_velocity, particle_direction, speed, number_density = self.environment(rotation_matrix)
+        with profiler.phase("visibility"):
+            face_weights, body_direction = self.mesh.projected_areas(rotation_matrix, particle_direction)
+            projected_area = face_weights.sum()
+        if projected_area == 0:
+            return total_torque, collisions_per_face, collision_points
+
+        with profiler.phase("particle_count"):
+            # Particles colliding with the satellite per timestep, from the density model and the projected area
+            actual_num_particles = number_density * 10**6 * speed * self.timestep * projected_area
+            expected_num_particles = actual_num_particles * self.actual_particle_mass / self.particle_mass
+            num_particles, particle_mass = self._sampled_particles(expected_num_particles,
+                                                                   int(np.ceil(expected_num_particles)))
+
+        with profiler.phase("sampling"):
+            faces, body_points = self.mesh.sample_points(face_weights, num_particles, self.rng)
+        with profiler.phase("shadowing"):
+            lit = ~self.mesh.shadowed(body_points, faces, body_direction, face_weights)
+            faces, body_points = faces[lit], body_points[lit]
+
+        with profiler.phase("torque"):
+            counts = np.bincount(faces, minlength=len(self.faces))
+            total_torque, self.torque_stderr = sampling.collision_torque(
+                body_points, counts, self.sat, particle_velocity, particle_mass, self.timestep,
+                angular_velocity=angular_velocity)
+            collision_points = (body_points - self.sat.com) @ rotation_matrix.T
+        collisions_per_face.update({face: int(count) for face, count in zip(self.faces, counts)})
+        self._update_torque_variance(num_particles, particle_mass)
+
+        return total_torque, collisions_per_face, collision_points
+
+    def _compute_table_torque(self, rotation_matrix, angular_velocity=None):
+        """
+        compute_torque() interpolated from the torque table; the collisions per face are the expected
+        ones and there are no collision points.
+        """
+        profiler = self.profiler
+        profiler.count("torque_evaluations")
+        angular_velocity = self.sat.angular_velocity if angular_velocity is None else angular_velocity
+        particle_velocity, particle_direction, speed, number_density = self.environment(rotation_matrix)
+
+        with profiler.phase("torque"):
+            flow_scale = number_density * 10**6 * speed * self.actual_particle_mass
+            total_torque, face_weights = self.torque_table.torque(rotation_matrix.T @ particle_direction,
+                                                                  angular_velocity, particle_velocity, flow_scale)
+        collisions = face_weights * flow_scale * self.timestep / self.particle_mass
+        return total_torque, dict(zip(self.faces, collisions)), np.empty((0, 3))
+
+    def step(self, factor=1):
+        """
+        Advance the simulation by one timestep, or by a coarse step of several timesteps.
+
+        :param factor: Number of timesteps of the step. A coarse step is integrated with a timestep
+                       and particle mass of factor times the fine ones, i.e. with the particle count
+                       of one timestep per torque evaluation, and with the torque averaged over its
+                       duration: the Euler integrator averages it over the torque_samples of the
+                       multi-rate stepping, RK4 and RK45 over their stages.
+        :return: Dictionary with the angular acceleration, collisions per face, rotation matrix and
+                 collision points at the start of this step, and the time at its end
+        """
+        samples = 1
+        if factor > 1 and self.multirate is not None:
+            samples = min(factor, self.multirate.torque_samples)
+        timestep, particle_mass = self.timestep, self.particle_mass
+        self.timestep, self.particle_mass = factor * timestep, factor * particle_mass
+        try:
+            angular_acceleration, collisions_per_face, rotation_matrix, collision_points, torque_stderr = \
+                self._advance(samples)
+        finally:
+            self.timestep, self.particle_mass = timestep, particle_mass
+
+        # Log the state and throughput every 10 timesteps, with the fine timestep
+        if self.progress is not None:
+            self.progress.update(self.step_index + factor - 1, self.timestep, self.sat.angular_velocity,
+                                 angular_acceleration, self.angles, collisions_per_face, self.num_particles,
+                                 None if self.collision_mode == "expected" else torque_stderr, steps=factor)
+
+        self.profiler.count("steps")
+        self.step_index += factor
+        return {
+            "time": self.step_index * self.timestep,
+            "angular_acceleration": angular_acceleration,
+            "particle_counts": collisions_per_face,
+            "rotation_matrix": rotation_matrix,
+            "collision_points": collision_points,
+            "torque_stderr": torque_stderr,
+            "num_particles": self.num_particles,
+        }
+
+    def _advance(self, samples=1):
+        """
+        Integrate the attitude and angular velocity over self.timestep.
+
+        :param samples: Number of attitudes the torque of an Euler step is averaged over (see _averaged_torque())
+        :return: Angular acceleration, collisions per face, rotation matrix and collision points at
+                 the start of the step, and the standard error of its torque
+        """
+        profiler = self.profiler
+        if self.integrator == "euler":
+            # Compute rotation matrix based on current angles
+            with profiler.phase("rotation_matrix"):
+                rotation_matrix = helpers.compute_rotation_matrix(self.angles)
+            if samples == 1:
+                total_torque, collisions_per_face, collision_points = self.compute_torque(rotation_matrix)
+                torque_stderr = self.torque_stderr
+            else:
+                total_torque, collisions_per_face, collision_points, torque_stderr = self._averaged_torque(samples)
+
+            with profiler.phase("integration"):
+                # Angular acceleration: alpha = I^(-1) * total_torque
+                angular_acceleration = self.inverse_inertia.dot(total_torque)
+
+                # Update angular velocity: omega = omega + alpha * dt
+                self.sat.angular_velocity += angular_acceleration * self.timestep
+
+                # Update rotational angles: theta = theta + omega * dt
+                self.angles += self.sat.angular_velocity * self.timestep
+        else:
+            with profiler.phase("integration"):
+                rotation_matrix, angular_acceleration, collisions_per_face, collision_points = self._propagate()
+            torque_stderr = self.torque_stderr
+        return angular_acceleration, collisions_per_face, rotation_matrix, collision_points, torque_stderr
+
+    def _averaged_torque(self, samples):
+        """
+        Torque of a coarse Euler step averaged over its duration: the mean of the torques at the
+        attitudes at the midpoints of `samples` equal parts of the step, predicted with the current
+        angular velocity (coarse steps are only taken while the dynamics are quiescent).
+
+        :param samples: Number of torque evaluations
+        :return: Mean torque, the collisions per face and collision points of the first evaluation,
+                 and the standard error of the mean torque
+        """
+        total_torque, variance = np.zeros(3), np.zeros(3)
+        for sample in range(samples):
+            angles = self.angles + self.sat.angular_velocity * ((sample + 0.5) / samples * self.timestep)
+            with self.profiler.phase("rotation_matrix"):
+                rotation_matrix = helpers.compute_rotation_matrix(angles)
+            torque, collisions, points = self.compute_torque(rotation_matrix)
+            if sample == 0:
+                collisions_per_face, collision_points = collisions, points
+            total_torque += torque
+            variance += self.torque_stderr**2
+        return total_torque / samples, collisions_per_face, collision_points, np.sqrt(variance) / samples
+
+    def _propagate(self):
+        """
+        Propagate the quaternion attitude and angular velocity over one timestep with RK4 or RK45.
+
+        :return: Rotation matrix, angular acceleration, collisions per face and collision points at
+                 the start of the timestep
+        """
+        first_stage = []
+
+        def derivative(state):
+            quaternion, angular_velocity = state[:4], state[4:]
+            with self.profiler.phase("rotation_matrix"):
+                rotation_matrix = attitude.rotation_matrix(quaternion / np.linalg.norm(quaternion))
+            total_torque, collisions_per_face, collision_points = self.compute_torque(rotation_matrix, angular_velocity)
+            angular_acceleration = attitude.angular_acceleration(angular_velocity, total_torque,
+                                                                 self.sat.inertia_matrix, self.inverse_inertia)
+            if not first_stage:
+                first_stage.extend([rotation_matrix, angular_acceleration, collisions_per_face, collision_points])
+            return np.concatenate([attitude.quaternion_derivative(quaternion, angular_velocity), angular_acceleration])
+
+        state = np.concatenate([self.quaternion, self.sat.angular_velocity])
+        state, self.step_size = attitude.propagate(derivative, state, self.timestep, self.integrator,
+                                                   self.step_size, self.rtol, self.atol)
+
+        self.quaternion = state[:4]
+        self.sat.angular_velocity = state[4:].copy()
+        self.angles = attitude.angles_from_rotation_matrix(attitude.rotation_matrix(self.quaternion))
+        return tuple(first_stage)
+
+    def run(self, total_steps=None, writer=None, checkpoint_path=None, checkpoint_every=1000):
+        """
+        Run the simulation for a number of timesteps.
+
+        :param total_steps: Number of timesteps (defaults to the total_steps of the simulation)
+        :param writer: Optional output.RunWriter to stream the state of every timestep to, instead
+                       of keeping the histories in memory
+        :param checkpoint_path: Optional file to periodically save the full state of the run to, see
+                                checkpoint.resume(). With a writer the cost of a checkpoint does not
+                                grow with the run; without one it includes the rows of the histories
+                                filled so far.
+        :param checkpoint_every: Number of timesteps between checkpoints
+        :return: Dictionary with the angular velocity, angular acceleration, angle and torque standard
+                 error histories as (steps, 3) arrays, the particle counts as a (steps, faces) array,
+                 the face names of its columns, the sampled particle count and the time at the end
+                 of every step, the stop reason ("total_steps" or "converged") and the convergence
+                 metrics of the monitor (None without one); or the output.RunReader of the written
+                 output if a writer is given, with the stop reason and metrics in its metadata.
+                 The histories have total_steps rows unless the run stopped early or took coarse steps.
+        """
+        total_steps = self.total_steps if total_steps is None else total_steps
+
+        results = None
+        if writer is None:
+            results = {
+                "angular_velocity": np.empty((total_steps, 3)),
+                "angular_acceleration": np.empty((total_steps, 3)),
+                "angles": np.empty((total_steps, 3)),
+                "particle_counts": np.empty((total_steps, len(self.faces)), dtype=float if self.collision_mode == "expected" else int),
+                "torque_stderr": np.empty((total_steps, 3)),
+                "num_particles": np.empty(total_steps, dtype=int),
+                "time": np.empty(total_steps),
+                "faces": self.faces,
+            }
+        else:
+            # Geometry of the run, so that render.py can draw it from the stored output
+            writer.metadata.update(timestep=float(self.timestep), mesh=self.mesh is not None,
+                                   satellite=dict(length=float(self.sat.length), width=float(self.sat.width),
+                                                  height=float(self.sat.height), com=self.sat.com.tolist()))
+        self.history_rows = 0
+        return self.run_until(self.step_index + total_steps, writer, results, checkpoint_path, checkpoint_every)
+
+    def run_until(self, end_step, writer=None, results=None, checkpoint_path=None, checkpoint_every=1000):
+        """
+        Run the simulation until a step index, storing the histories in a writer or in the results
+        arrays created by run(). Used by run() and to continue a run from a checkpoint.
+        """
+        if self.timeline is not None and end_step > len(self.timeline):
+            raise ValueError(f"The timeline covers {len(self.timeline)} timesteps, the run needs {end_step}")
+        stop_reason = "total_steps"
+        while self.step_index < end_step:
+            step = self.step_index
+            factor = 1
+            if self.multirate is not None:
+                factor = min(self.multirate.factor(self.monitor, self.timestep), end_step - step)
+            previous_angular_velocity = self.sat.angular_velocity.copy()
+            record = self.step(factor)
+
+            with self.profiler.phase("output"):
+                if writer is not None:
+                    # The flow direction of an orbit timeline varies, render.py draws it per row
+                    flow = {} if self.timeline is None else {"flow_direction": self.timeline.flow_direction[step]}
+                    writer.write(step, self.sat.angular_velocity, record["angular_acceleration"], self.angles,
+                                 record["rotation_matrix"], [record["particle_counts"][face] for face in self.faces],
+                                 record["collision_points"], torque_stderr=record["torque_stderr"],
+                                 num_particles=record["num_particles"], time=record["time"], **flow)
+                else:
+                    row = self.history_rows
+                    results["angular_velocity"][row] = self.sat.angular_velocity
+                    results["angular_acceleration"][row] = record["angular_acceleration"]
+                    results["angles"][row] = self.angles
+                    results["particle_counts"][row] = [record["particle_counts"][face] for face in self.faces]
+                    results["torque_stderr"][row] = record["torque_stderr"]
+                    results["num_particles"][row] = record["num_particles"]
+                    results["time"][row] = record["time"]
+                    self.history_rows += 1
+
+            if self.monitor is not None:
+                flow_direction = (1, 0, 0) if self.timeline is None else self.timeline.flow_direction[step]
+                converged = self.monitor.update(record["time"], self.step_index, self.sat.angular_velocity,
+                                                record["rotation_matrix"], self.sat.inertia_matrix, flow_direction)
+                if self.multirate is not None:
+                    self.multirate.observe(self.monitor, factor, self.sat.angular_velocity - previous_angular_velocity)
+                    converged = self.monitor.converged
+                if converged and self.monitor.stop:
+                    stop_reason = "converged"
+                    break
+
+            # Checkpoint whenever the step index passes a multiple of checkpoint_every
+            if checkpoint_path is not None and step // checkpoint_every != self.step_index // checkpoint_every \
+                    and self.step_index < end_step:
+                with self.profiler.phase("checkpoint"):
+                    checkpoint.save(checkpoint_path, {
+                        "simulation": self,
+                        "writer": writer,
+                        "results": None if results is None else checkpoint.filled_rows(results, self.history_rows),
+                        "rows": None if results is None else len(results["angular_velocity"]),
+                        "end_step": end_step,
+                        "checkpoint_every": checkpoint_every,
+                    })
+
+        metrics = dict(self.monitor.metrics) if self.monitor is not None else None
+        if writer is None:
+            results = checkpoint.filled_rows(results, self.history_rows)
+            results["stop_reason"] = stop_reason
+            results["convergence"] = metrics
+            return results
+        writer.metadata.update(stop_reason=stop_reason, convergence=metrics)
+        with self.profiler.phase("output"):
+            return writer.close()
+
+
+def make_satellite(config):
+    """
+    Build a Satellite object from the satellite parameters of a configuration dictionary, taking the
+    missing parameters from __init__.sat_object.
+    """
+    base = __init__.sat_object
+    parameters = dict(length=base.length, width=base.width, height=base.height, com=base.com,
+                      initial_angular_velocity=base.angular_velocity, inertia_matrix=base.inertia_matrix,
+                      sim_id=base.sim_id)
+    parameters.update({name: value for name, value in config.items() if name in satellite_parameters})
+    return __init__.Satellite(**parameters)
+
+
+def build(config=None):
+    """
+    Build the Simulation of a configuration dictionary (see run()) without running it.
+    """
+    config = {} if config is None else config
+    options = {name: value for name, value in config.items() if name not in satellite_parameters}
+    return Simulation(make_satellite(config), **options)
+
+
+def run(config=None, writer=None, checkpoint_path=None, checkpoint_every=1000):
+    """
+    Run one simulation from a configuration dictionary.
+
+    :param config: Satellite parameters (length, width, height, com, initial_angular_velocity,
+                   inertia_matrix, sim_id) and Simulation parameters (timestep, total_steps,
+                   collision_mode, angles, seed, ...). Missing values default to __init__.py.
+    :param writer: Optional output.RunWriter to stream the output to
+    :param checkpoint_path: Optional file to periodically save the state of the run to
+    :param checkpoint_every: Number of timesteps between checkpoints
+    :return: Results of Simulation.run()
+    """
+    return build(config).run(writer=writer, checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every)
@@ -1,95 +1,212 @@
-import numpy as np
-import pandas as pd
-import random
-import helpers 
-import __init__
-
-
-# Tracking particle collisions
-particle_counts = {face: [] for face in __init__.face_normals.keys()}
-
-# Initialize lists to store angular velocity and acceleration data for plotting
-angular_velocity_history = []
-angular_acceleration_history = []
-
-# Simulation loop
-for step in range(__init__.total_steps):
-    
-    total_torque = np.zeros(3)  # Reset total torque for each __init__.timestep
-    collisions_per_face = {face: 0 for face in __init__.face_normals.keys()}  # Reset particle count for this __init__.timestep
-    collision_points = []
-    sum_surface = 0
-
-    # Compute rotation matrix based on current __init__.angles
-    rotation_matrix = helpers.compute_rotation_matrix(__init__.angles)
-    particle_direction = np.array([1, 0, 0])  # Particles moving along +X in global frame
-
-    # Calculate dot products and probabilities
-    dot_products = {}
-    for face, normal in __init__.face_normals.items():
-        global_normal = rotation_matrix @ normal  # Rotate normal to global frame
-        dot_product = np.dot(global_normal, particle_direction)
-        if dot_product > 0:  # Consider only faces eligible for collision
-            dot_products[face] = dot_product
-            sum_surface += __init__.sat_object.surface_area[face]
-    
-    #Compute actual number of particles colliding with satellite per __init__.timestep based on density model
-    actual_num_particles = sum(helpers.density_array[0]) * 10**6 * __init__.particle_velocity[0] * __init__.timestep * sum_surface
-    
-    #Compute simulated number of particles based on arbitrary simulated particle mass 
-    num_particles = int(np.ceil(actual_num_particles * __init__.actual_particle_mass / __init__.particle_mass))
-
-    if dot_products:
-        # Normalize dot products to probabilities
-        total_dot = sum(dot_products.values())
-        total_surface = sum(__init__.sat_object.surface_area.values())
-        probabilities = {face: dp / total_dot for face, dp in dot_products.items()}
-        # Distribute particles across eligible faces based on probabilities
-        
-        for _ in range(num_particles):
-            face = random.choices(list(probabilities.keys()), weights=probabilities.values())[0]
-            collision_point = helpers.generate_collision_point(face)  # Random collision point
-            r = collision_point - __init__.sat_object.com # Lever arm (in meters)
-            satellite_velocity = np.cross(r, __init__.sat_object.angular_velocity)
-            relative_velocity = satellite_velocity - __init__.particle_velocity
-            force = (__init__.particle_mass * relative_velocity)/__init__.timestep
-            torque = np.cross(r, force)  # Torque due to one particle
-            total_torque += torque  # Accumulate torque
-            collisions_per_face[face] += 1  # Increment particle count for the selected face
-            collision_points.append((rotation_matrix @ (collision_point - __init__.sat_object.com), __init__.face_colors[face]))
-
-    # Angular acceleration: alpha = I^(-1) * total_torque
-    angular_acceleration = np.linalg.inv(__init__.sat_object.inertia_matrix).dot(total_torque)
-
-    # Update angular velocity: omega = omega + alpha * dt
-    __init__.sat_object.angular_velocity += angular_acceleration * __init__.timestep
-
-    # Update rotational __init__.angles: theta = theta + omega * dt
-    __init__.angles += __init__.sat_object.angular_velocity * __init__.timestep
-
-    # Store particle counts for this __init__.timestep
-    for face, count in collisions_per_face.items():
-        particle_counts[face].append(count)
-    
-    # Store angular velocity, acceleration and collision points data ready for export
-    angular_velocity_history.append(__init__.sat_object.angular_velocity.copy())
-    angular_acceleration_history.append(angular_acceleration.copy())
-    
-    # Print results for the current __init__.timestep
-    if(step%10==0):
-        
-        print(f"Step {step + 1}:")
-        print(f"  Angular Acceleration: {angular_acceleration}")
-        print(f"  Angular Velocity: {__init__.sat_object.angular_velocity}")
-        print(f"  __init__.angles: {__init__.angles}")
-        print(f"  Particle Counts: {collisions_per_face}")
-        print("-" * 40)
-
-#Exporting angular velocity, acceleration and collision points
-
-np.savetxt("angular_velocity_" + __init__.sat_object.sim_id + ".csv", angular_velocity_history, delimiter=",")
-np.savetxt("angular_acceleration_" + __init__.sat_object.sim_id + ".csv", angular_acceleration_history, delimiter=",")
-
-(pd.DataFrame.from_dict(data=particle_counts, orient='index')
-   .to_csv("particle_counts_" + __init__.sat_object.sim_id + ".csv", header=False))
+"""
+Command line entry point of the simulation.
 
+Computes angular velocity, acceleration and particle collisions for given time steps and exports
+them into .csv files for post-processing, or streams them into .npy files during the run
+(--output npy, see output.py) for long runs. Heavy modules (the density model, scipy, pandas) are only
+imported once they are needed, so --help and argument errors return immediately.
+
+Example:
+
+    python solver.py Delfi_n3xt --steps 1000 --timestep 0.1 --length 0.3 --com 0.1 0.05 0.05
+"""
+
+import argparse
+import os
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line arguments. Geometry arguments that are not given default to
+    __init__.sat_object and simulation arguments to the values in __init__.py.
+    """
+    parser = argparse.ArgumentParser(description="Attitude dynamics of a satellite under drag in LEO")
+    parser.add_argument("sim_id", nargs="?", help="Description of the simulation used in the output file names")
+    parser.add_argument("--steps", type=int, dest="total_steps", help="Number of timesteps")
+    parser.add_argument("--timestep", type=float, help="Duration of one timestep (s)")
+    parser.add_argument("--mode", dest="collision_mode", choices=["monte_carlo", "expected"],
+                        help="Sampled particles or closed-form expected torque")
+    parser.add_argument("--integrator", choices=["euler", "rk4", "rk45"],
+                        help="Explicit Euler on the angles, or quaternion attitude with RK4 / adaptive RK45")
+    parser.add_argument("--seed", type=int, help="Seed of the collision sampling")
+    parser.add_argument("--sampling", choices=["random", "stratified", "sobol"], help="Collision sampling method")
+    parser.add_argument("--torque-tolerance", type=float,
+                        help="Target standard error of the sampled torque (N·m), sets the particle count per step")
+    parser.add_argument("--workers", type=int,
+                        help="Split the particles of each step over this many threads or processes (see parallel.py)")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread", help="Worker pool of --workers")
+    parser.add_argument("--orbit", type=float, nargs=3, metavar=("PERIGEE", "APOGEE", "INCLINATION"),
+                        help="Propagate an orbit with perigee and apogee altitudes (km) and inclination (degrees) "
+                             "for varying flow direction and density (see orbit.py)")
+    parser.add_argument("--density-every", type=int, default=1,
+                        help="Evaluate the density model every this many steps along the --orbit")
+    parser.add_argument("--stop-when-converged", action="store_true",
+                        help="Stop the run once the oscillation amplitudes and energy are steady (see convergence.py)")
+    parser.add_argument("--convergence-window", type=int, default=500,
+                        help="Number of timesteps the convergence metrics are computed over")
+    parser.add_argument("--multirate", type=int, metavar="MAX_FACTOR",
+                        help="Merge up to this many timesteps into one step while the dynamics are quiescent")
+    parser.add_argument("--torque-table", metavar="DIRECTORY",
+                        help="Interpolate the torque from a lookup table of the geometry, loaded from or saved to "
+                             "this directory (see lookup.py)")
+    parser.add_argument("--table-resolution", type=int, default=32,
+                        help="Cells along each edge of a cube face of the torque table (even)")
+    parser.add_argument("--table-samples", type=int,
+                        help="Tabulate the torque from this many sampled particles per direction instead of in "
+                             "closed form (always sampled with --mesh)")
+    parser.add_argument("--cache", metavar="DIRECTORY",
+                        help="Look the run up in a cache of runs keyed by their full configuration, and store it there; "
+                             "a longer run continues a cached shorter one (see cache.py, csv output only, without checkpoints)")
+    parser.add_argument("--cache-size", type=float, default=1.0, help="Size limit of the --cache (GB)")
+    parser.add_argument("--length", type=float, help="Length of the satellite (m)")
+    parser.add_argument("--width", type=float, help="Width of the satellite (m)")
+    parser.add_argument("--height", type=float, help="Height of the satellite (m)")
+    parser.add_argument("--com", type=float, nargs=3, metavar=("X", "Y", "Z"), help="Centre of mass (m)")
+    parser.add_argument("--omega", type=float, nargs=3, metavar=("WX", "WY", "WZ"), dest="initial_angular_velocity",
+                        help="Initial angular velocity (rad/s)")
+    parser.add_argument("--inertia", type=float, nargs=3, metavar=("IXX", "IYY", "IZZ"),
+                        help="Principal moments of inertia (kg·m²)")
+    parser.add_argument("--mesh", help="Wavefront .obj file of the satellite surface (body frame, replaces the box geometry)")
+    parser.add_argument("--mesh-scale", type=float, default=1.0, help="Factor converting the .obj coordinates to meters")
+    parser.add_argument("--output", choices=["csv", "npy"], default="csv",
+                        help="Export .csv files at the end of the run, or stream .npy files during the run")
+    parser.add_argument("--output-dir", default=".", help="Directory of the output files")
+    parser.add_argument("--points-per-step", type=int, default=0,
+                        help="Collision points stored per timestep with --output npy (-1 stores all)")
+    parser.add_argument("--reservoir", type=int, default=0,
+                        help="Size of a reservoir sample of collision points over the run with --output npy")
+    parser.add_argument("--checkpoint", help="Checkpoint file, saved periodically during the run")
+    parser.add_argument("--checkpoint-every", type=int,
+                        help="Number of timesteps between checkpoints (default 1000, or that of the run with --resume)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the run saved in the --checkpoint file (other simulation options are ignored)")
+    parser.add_argument("--profile", help="Write a JSON summary of the time spent in each phase of a step to this file")
+    parser.add_argument("--trace", help="Write a Chrome trace of the phases of every step to this file")
+    parser.add_argument("--quiet", action="store_true", help="Do not log the state every 10 timesteps")
+    args = parser.parse_args(argv)
+    if args.cache is not None and args.output == "npy":
+        parser.error("--cache stores the results in memory and cannot be combined with --output npy")
+    if args.cache is not None and (args.checkpoint is not None or args.checkpoint_every is not None):
+        parser.error("--cache cannot be combined with --checkpoint or --checkpoint-every")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    import numpy as np
+    import profiling
+    import simulation
+
+    profiler = None
+    if args.profile is not None or args.trace is not None:
+        profiler = profiling.Profiler(trace=args.trace is not None)
+
+    if args.resume:
+        import checkpoint
+
+        if args.checkpoint is None:
+            raise SystemExit("--resume requires --checkpoint")
+        state = checkpoint.load(args.checkpoint)
+        config = {"sim_id": state["simulation"].sat.sim_id}
+        results = checkpoint.resume(args.checkpoint, args.checkpoint_every, profiler, state)
+    else:
+        cli_only = ("inertia", "quiet", "output", "output_dir", "points_per_step", "reservoir",
+                    "checkpoint", "checkpoint_every", "resume", "profile", "trace", "mesh", "mesh_scale",
+                    "workers", "executor", "orbit", "density_every", "stop_when_converged",
+                    "convergence_window", "multirate", "torque_table", "table_resolution", "table_samples", "cache", "cache_size")
+        config = {name: value for name, value in vars(args).items() if value is not None and name not in cli_only}
+        if args.inertia is not None:
+            config["inertia_matrix"] = np.diag(args.inertia)
+        if args.sim_id is None:
+            config["sim_id"] = input("Enter simulation id")
+        config["verbose"] = not args.quiet
+        config["profiler"] = profiler
+        faces = None
+        if args.mesh is not None:
+            import geometry
+
+            config["mesh"] = geometry.Mesh.load_obj(args.mesh, args.mesh_scale)
+            faces = config["mesh"].face_names
+        if args.orbit is not None:
+            import orbit
+            import __init__
+
+            perigee, apogee, inclination = args.orbit
+            config["timeline"] = orbit.Orbit.from_altitudes(perigee, apogee, inclination=inclination).timeline(
+                config.get("timestep", __init__.timestep), config.get("total_steps", __init__.total_steps),
+                density_every=args.density_every)
+        if args.torque_table is not None:
+            import lookup
+
+            os.makedirs(args.torque_table, exist_ok=True)
+            sampled = args.table_samples is not None or "mesh" in config
+            config["torque_table"] = lookup.TorqueTable.cached(
+                simulation.make_satellite(config), config.get("mesh"), args.torque_table,
+                resolution=args.table_resolution, method="sampled" if sampled else "expected",
+                samples=args.table_samples or 10**5, seed=args.seed)
+            print(f"Torque table interpolation error: {config['torque_table'].errors}")
+        if args.stop_when_converged or args.multirate is not None:
+            import convergence
+
+            config["monitor"] = convergence.ConvergenceMonitor(args.convergence_window, stop=args.stop_when_converged)
+            if args.multirate is not None:
+                config["multirate"] = convergence.MultiRate(args.multirate)
+        checkpoint_every = 1000 if args.checkpoint_every is None else args.checkpoint_every
+        if args.workers is not None:
+            import parallel
+
+            config["parallel"] = parallel.ParallelTorque(args.workers, args.seed, args.executor,
+                                                         return_points=args.output == "npy" and
+                                                         (args.points_per_step != 0 or args.reservoir > 0))
+
+        try:
+            if args.output == "npy":
+                import output
+
+                writer = output.RunWriter(args.output_dir, config["sim_id"], faces, chunk_size=4096,
+                                          points_per_step=None if args.points_per_step < 0 else args.points_per_step,
+                                          reservoir_size=args.reservoir, seed=args.seed)
+                results = simulation.run(config, writer=writer, checkpoint_path=args.checkpoint,
+                                         checkpoint_every=checkpoint_every)
+            elif args.cache is not None:
+                import cache
+
+                run_cache = cache.RunCache(args.cache, int(args.cache_size * 1e9))
+                results = run_cache.run(config)
+                print(f"Run cache: {run_cache.status}")
+            else:
+                results = simulation.run(config, checkpoint_path=args.checkpoint, checkpoint_every=checkpoint_every)
+        finally:
+            if "parallel" in config:
+                config["parallel"].close()
+
+    if profiler is not None:
+        if args.profile is not None:
+            profiler.save_summary(args.profile)
+        if args.trace is not None:
+            profiler.save_trace(args.trace)
+
+    if not isinstance(results, dict):
+        return  # Streamed to .npy files during the run
+
+    if results.get("stop_reason") == "converged":
+        print(f"Converged after {results['time'][-1]:g} s: {results['convergence']}")
+
+    import pandas as pd
+
+    prefix = os.path.join(args.output_dir, "")
+
+    #Exporting the time, angular velocity, acceleration and particle counts
+    # (one row per step; coarse steps and an early stop make the time of a row differ from row * timestep)
+
+    np.savetxt(prefix + "time_" + config["sim_id"] + ".csv", results["time"], delimiter=",")
+    np.savetxt(prefix + "angular_velocity_" + config["sim_id"] + ".csv", results["angular_velocity"], delimiter=",")
+    np.savetxt(prefix + "angular_acceleration_" + config["sim_id"] + ".csv", results["angular_acceleration"], delimiter=",")
+
+    (pd.DataFrame(results["particle_counts"].T, index=results["faces"])
+       .to_csv(prefix + "particle_counts_" + config["sim_id"] + ".csv", header=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Sweep engine to find the most stable satellite configuration.
+
+A sweep point is a dictionary with any of the Satellite parameters (length, width, height, com,
+initial_angular_velocity, inertia_matrix). Parameters that are not given are taken from
+__init__.sat_object. Every point is simulated in its own process with an independent random
+stream spawned from a single seed, so a sweep is reproducible for a given seed whatever the
+number of workers.
+
+Example, sweeping the centre of mass along X for two initial angular velocities:
+
+    points = sweep.grid(com=[[0.1, 0.05, 0.05], [0.15, 0.05, 0.05], [0.2, 0.05, 0.05]],
+                        initial_angular_velocity=[[0.26, 0.16, 0], [0, 0.16, 0]])
+    table = sweep.run_sweep(points, total_steps=1000, seed=42)
+"""
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import simulation
+import __init__
+
+
+def grid(**values):
+    """
+    Build the full factorial grid of the given parameter values.
+    :param values: Lists of values per Satellite parameter, e.g. length=[0.1, 0.2]
+    :return: List of sweep points (dictionaries)
+    """
+    names = list(values.keys())
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+
+def sample(num_points, seed=None, **bounds):
+    """
+    Draw sweep points uniformly between lower and upper bounds.
+    :param num_points: Number of sweep points
+    :param seed: Seed of the random generator
+    :param bounds: (low, high) pair per Satellite parameter; scalars or arrays of matching shape,
+                   e.g. com=([0.1, 0.04, 0.04], [0.2, 0.06, 0.06])
+    :return: List of sweep points (dictionaries)
+    """
+    rng = np.random.default_rng(seed)
+    points = []
+    for _ in range(num_points):
+        point = {}
+        for name, (low, high) in bounds.items():
+            value = np.asarray(rng.uniform(np.asarray(low, dtype=float), np.asarray(high, dtype=float)))
+            point[name] = value.item() if value.ndim == 0 else value
+        points.append(point)
+    return points
+
+
+def stability_metrics(angular_velocity_history, timestep, settle_tolerance=0.05, window_fraction=0.2):
+    """
+    Compute stability metrics from an angular velocity history.
+    :param angular_velocity_history: (steps, 3) array of angular velocities (rad/s)
+    :param timestep: Duration of one timestep (s)
+    :param settle_tolerance: Band around the final |ω| within which the run counts as settled, as a
+                             fraction of the maximum |ω|
+    :param window_fraction: Fraction of the run at its end used to evaluate the final state
+    :return: Dictionary with final |ω| (rad/s), settling time (s) and oscillation amplitude (rad/s)
+    """
+    angular_speed = np.linalg.norm(angular_velocity_history, axis=1)
+    window = max(1, int(len(angular_speed) * window_fraction))
+    final_window = angular_velocity_history[-window:]
+
+    # Settling time: time after which |ω| stays within the band around its final mean value
+    band = settle_tolerance * angular_speed.max()
+    outside = np.nonzero(np.abs(angular_speed - angular_speed[-window:].mean()) > band)[0]
+    settling_step = outside[-1] + 1 if len(outside) else 0
+
+    return {
+        "final_angular_speed": angular_speed[-1],
+        "settling_time": settling_step * timestep if settling_step < len(angular_speed) else np.nan,
+        # Half of the peak to peak oscillation of the angular velocity components in the final window
+        "oscillation_amplitude": (np.ptp(final_window, axis=0) / 2).max(),
+    }
+
+
+def run_point(point, total_steps=None, timestep=None, collision_mode=None, seed_sequence=None, cache_dir=None):
+    """
+    Simulate one sweep point and compute its stability metrics.
+    :param point: Sweep point (dictionary of Satellite parameters)
+    :param total_steps: Number of timesteps
+    :param timestep: Duration of one timestep (s)
+    :param collision_mode: "monte_carlo" or "expected"
+    :param seed_sequence: numpy.random.SeedSequence of the random stream of this point
+    :param cache_dir: Optional directory of a cache.RunCache to look the run up in and store it to
+    :return: Dictionary of stability metrics
+    """
+    timestep = __init__.timestep if timestep is None else timestep
+    sim = simulation.Simulation(simulation.make_satellite(point), timestep, total_steps, collision_mode,
+                                seed=seed_sequence)
+    if cache_dir is None:
+        results = sim.run()
+    else:
+        import cache
+
+        results = cache.RunCache(cache_dir).run_simulation(sim)
+    return stability_metrics(results["angular_velocity"], timestep)
+
+
+def _run_point_safely(point, kwargs):
+    """Worker entry point: a failing point returns its error instead of aborting the sweep."""
+    try:
+        return run_point(point, **kwargs), None
+    except Exception as exc:
+        return {}, f"{type(exc).__name__}: {exc}"
+
+
+def run_sweep(points, total_steps=None, timestep=None, collision_mode=None, seed=None, max_workers=None,
+              cache_dir=None):
+    """
+    Simulate every sweep point in a process pool and collect the stability metrics.
+    :param points: List of sweep points, see grid() and sample()
+    :param total_steps: Number of timesteps per simulation (defaults to __init__.total_steps)
+    :param timestep: Duration of one timestep in s (defaults to __init__.timestep)
+    :param collision_mode: "monte_carlo" or "expected" (defaults to __init__.collision_mode)
+    :param seed: Seed from which the independent random streams of all points are spawned
+    :param max_workers: Number of worker processes (defaults to the number of cores)
+    :param cache_dir: Optional directory of a cache.RunCache shared by the workers, so that points
+                      simulated by an earlier sweep with the same seed are not simulated again
+    :return: pandas DataFrame with one row per point: its parameters, stability metrics and the
+             error message of failed points
+    """
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(points))
+    rows = [None] * len(points)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_run_point_safely, point,
+                                   dict(total_steps=total_steps, timestep=timestep,
+                                        collision_mode=collision_mode, seed_sequence=seed_sequence,
+                                        cache_dir=cache_dir))
+                   for point, seed_sequence in zip(points, seed_sequences)]
+
+        for index, future in enumerate(futures):
+            try:
+                metrics, error = future.result()
+            except Exception as exc:  # e.g. a worker process that died
+                metrics, error = {}, repr(exc)
+            rows[index] = dict(points[index], **metrics, error=error)
+
+    return pd.DataFrame(rows)